@@ -0,0 +1,606 @@
+"""
+An asyncio entry point for the node. It serves the same routes as
+blockchain.py from a single event loop instead of a thread per request, so
+an idle long-polling miner, a peer sync or a slow `/chain` download costs a
+coroutine and a socket buffer rather than a whole worker thread.
+
+Anything that hashes, validates blocks or takes the chain's lock runs in a
+thread pool, so the loop itself never waits on the chain. Long-polls are
+woken by one watcher thread for all of them.
+
+It opens the chain from the same environment as blockchain.py but never
+imports Flask.
+
+IE `python3 async_server.py 5000`
+"""
+import asyncio
+import re
+import sys
+
+from functools import partial
+from itertools import islice
+from json import dumps, loads
+from os import environ, path
+from sys import argv
+from threading import Thread
+from time import perf_counter
+from traceback import print_exc
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from core import wire  # noqa: E402
+
+from core.api import (CHAIN_RESPONSE_BYTES, MINE_REJECTIONS, MINE_SUBMISSIONS, gauges, open_chain,  # noqa: E402
+                      parse_line, rejection)
+from core.chain import REWARD, Block, Blockchain, StaleBlockError, Transaction  # noqa: E402
+from core.mempool import MempoolError  # noqa: E402
+from core.metrics import CONTENT_TYPE, REGISTRY, request_histogram  # noqa: E402
+from core.profiling import PROFILER, ProfilerError  # noqa: E402
+
+# Longest request line or header, and most bytes of headers in one request
+MAX_LINE = 8 * 1024
+MAX_HEADERS = 64 * 1024
+# Largest request body accepted
+MAX_BODY = 64 * 1024 * 1024
+# Seconds an idle keep-alive connection is held open between requests
+KEEP_ALIVE = 300
+# Blocks read per trip to the thread pool while streaming /chain
+CHAIN_BATCH = 256
+
+# The same chain blockchain.py would open, IE with `BLOCKCHAIN_PATH`
+blockchain = open_chain(environ, transactions=True, wallet=True)
+gauges(lambda: blockchain)
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class BadRequest(Exception):
+    """
+    Raised when a request can not be parsed
+    """
+
+
+class Request():
+    __slots__ = ('method', 'path', 'args', 'headers', 'body', 'keep_alive', 'remote_addr')
+
+    def __init__(self, method: str, target: str, version: str, headers: Dict[str, str], body: bytes,
+                 remote_addr: str = None):
+        url = urlsplit(target)
+        self.method = method
+        self.path = unquote(url.path)
+        self.args = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+        self.remote_addr = remote_addr
+        connection = headers.get('connection', '').lower()
+        self.keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+    def arg(self, name: str, default, type: Callable = str):
+        """
+        A query argument converted with `type`, or `default` when it is
+        missing or does not convert, like Flask's `request.args.get`
+        """
+        try:
+            return type(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    @property
+    def mimetype(self) -> str:
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    def json(self):
+        """
+        :return: The parsed JSON body, or None if it is not JSON
+        """
+        try:
+            return loads(self.body)
+        except ValueError:
+            return None
+
+
+class Response():
+    __slots__ = ('status', 'body', 'content_type', 'headers')
+
+    def __init__(self, body: Union[bytes, AsyncIterator[bytes]] = b'', status: int = 200,
+                 content_type: str = 'application/json', headers: Dict[str, str] = None):
+        """
+        :param body: <bytes> The whole body, or an async iterator of chunks
+        that is sent with chunked transfer encoding
+        """
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+def jsonify(value, status: int = 200) -> Response:
+    return Response(dumps(value).encode('utf-8'), status)
+
+
+routes: List[Tuple[str, str, 're.Pattern', Callable]] = []
+
+
+def route(rule: str, methods=('GET',)):
+    """
+    Registers a handler for a Flask style rule such as
+    `/block/<int:index>/proof/<transaction_hash>`. Handlers are profiled as
+    the 'request' section, like the Flask app's requests
+    """
+    def compile_rule(match):
+        converter, name = match.group(1), match.group(2)
+        return f'(?P<{name}>[0-9]+)' if converter == 'int' else f'(?P<{name}>[^/]+)'
+
+    pattern = re.compile('^' + re.sub(r'<(?:(\w+):)?(\w+)>', compile_rule, rule) + '$')
+    converters = {name: converter for converter, name in re.findall(r'<(\w+):(\w+)>', rule)}
+
+    def register(handler):
+        # Stopping from inside a profiled request would wait on itself
+        profiled = handler if rule == '/admin/profile' else PROFILER.section('request')(handler)
+
+        async def call(request: Request, **params):
+            for name, converter in converters.items():
+                if converter == 'int':
+                    params[name] = int(params[name])
+            return await profiled(request, **params)
+
+        for method in methods:
+            routes.append((method, rule, pattern, call))
+        return handler
+    return register
+
+
+async def run(function: Callable, *args):
+    """
+    Runs a blocking call in the thread pool and waits for it without
+    blocking the loop
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, partial(function, *args))
+
+
+class TipWatcher():
+    """
+    Keeps the last block where the loop can read it without the chain's
+    lock and wakes every coroutine long-polling for a new tip. A single
+    thread waits on the chain for all of them.
+    """
+
+    def __init__(self, chain: Blockchain, loop: asyncio.AbstractEventLoop):
+        self.chain = chain
+        self.loop = loop
+        self.tip: Block = chain.last_block
+        self.changed = loop.create_future()
+        Thread(target=self.watch, daemon=True).start()
+
+    def watch(self):
+        known = self.tip.hash()
+        while True:
+            block = self.chain.wait_for_tip(known, 60)
+            if block.hash() != known:
+                known = block.hash()
+                try:
+                    self.loop.call_soon_threadsafe(self.update, block)
+                except RuntimeError:
+                    # The loop has been closed
+                    return
+
+    def update(self, block: Block):
+        self.tip = block
+        changed, self.changed = self.changed, self.loop.create_future()
+        changed.set_result(block)
+
+    async def wait(self, known_hash: Optional[str], timeout: float) -> Block:
+        """
+        :return: <Block> The last block, once its hash is no longer
+        `known_hash` or `timeout` seconds have passed
+        """
+        deadline = self.loop.time() + timeout
+        while self.tip.hash() == known_hash:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(self.changed), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.tip
+
+
+watcher: TipWatcher = None
+
+
+@route('/new_transaction', methods=['POST'])
+async def new_transaction(request: Request):
+    fields = request.json()
+    try:
+        transaction = await run(blockchain.new_transaction, fields['sender'], fields['receiver'], fields['amount'])
+    except (KeyError, TypeError):
+        return jsonify({'message': "A transaction needs a sender, receiver and amount"}, 400)
+    except MempoolError as error:
+        return jsonify({'message': str(error)}, 400)
+    return jsonify(dict(transaction))
+
+
+@route('/new_transactions', methods=['POST'])
+async def new_transactions(request: Request):
+    if request.mimetype == 'application/x-ndjson':
+        transactions = [parse_line(line) for line in request.body.splitlines() if line.strip()]
+    elif request.mimetype == wire.MIMETYPE:
+        try:
+            transactions = wire.decode_transactions(request.body)
+        except wire.WireError as error:
+            return jsonify({'message': str(error)}, 400)
+    else:
+        transactions = request.json()
+        if not isinstance(transactions, list):
+            return jsonify({'message': "Expected a JSON array of transactions"}, 400)
+
+    return jsonify(await run(blockchain.new_transactions, transactions))
+
+
+def block_response(request: Request, block: Block, header_only: bool = False) -> Response:
+    """
+    A block as JSON, or in the binary wire encoding when the client's
+    Accept header prefers it
+    """
+    if wire.prefers_binary(request.headers.get('accept', '')):
+        return Response(block.encode_binary(header_only), content_type=wire.MIMETYPE)
+    return Response(block.encode_header() if header_only else block.encode())
+
+
+def rejected(message: str, tip: Block) -> Response:
+    return jsonify(rejection(message, tip), 409)
+
+
+def submit(request: Request, proof, miner: str, last_block: Block):
+    """
+    Checks a proof against `last_block` and adds the block it makes. Runs
+    in the thread pool since it hashes and takes the write lock
+    """
+    if not Blockchain.valid_proof(str(last_block), proof, last_block.difficulty):
+        blockchain.record_submission(proof, last_block, 'invalid')
+        MINE_SUBMISSIONS.inc(result='invalid')
+        return jsonify("Invalid Proof", 400)
+
+    reward = Transaction(f"node {last_block.index + 1}", miner, REWARD)
+    try:
+        block = blockchain.new_block(proof, last_block.hash(), miner, reward)
+    except StaleBlockError:
+        blockchain.record_submission(proof, last_block, None)
+        MINE_SUBMISSIONS.inc(result='stale')
+        return rejected("Stale Proof", blockchain.last_block)
+    except Exception:
+        blockchain.record_submission(proof, last_block, None)
+        raise
+    blockchain.record_submission(proof, last_block, 'accepted')
+    MINE_SUBMISSIONS.inc(result='accepted')
+    return block_response(request, block)
+
+
+@route('/mine', methods=['POST'])
+async def mine(request: Request):
+    fields = request.json()
+    if not isinstance(fields, dict) or 'proof' not in fields or 'miner' not in fields:
+        return jsonify({'message': "A submission needs a proof and a miner"}, 400)
+
+    # The cached tip makes turning away a stale or repeated proof lock free
+    tip = watcher.tip
+    previous_hash = fields.get('previous_hash')
+    if previous_hash is not None and previous_hash != tip.hash():
+        # The watcher may not have caught up with a new tip yet
+        tip = await run(lambda: blockchain.last_block)
+    rejection = blockchain.screen_submission(fields['proof'], previous_hash, tip)
+    if rejection == 'invalid':
+        MINE_SUBMISSIONS.inc(result='invalid')
+        return jsonify("Invalid Proof", 400)
+    if rejection is not None:
+        MINE_REJECTIONS.inc(reason=rejection)
+        return rejected(f"{rejection.capitalize()} Proof", tip)
+    return await run(submit, request, fields['proof'], fields['miner'], tip)
+
+
+@route('/chain')
+async def full_chain(request: Request):
+    """
+    Streams the chain as a JSON list, or as length prefixed blocks in the
+    binary wire encoding, a batch of blocks at a time. Takes the same
+    `?start=&limit=` and `?since=` arguments and ETag as the Flask route
+    """
+    if 'since' in request.args:
+        start = request.arg('since', -1, int) + 1
+    else:
+        start = request.arg('start', 0, int)
+    start = max(start, 0)
+    limit = request.arg('limit', None, int)
+    tip, end, previous_hash = await run(blockchain.chain_range, start, limit)
+    if f'"{tip}"' in request.headers.get('if-none-match', ''):
+        return Response(status=304, headers={'ETag': f'"{tip}"'})
+
+    binary = wire.prefers_binary(request.headers.get('accept', ''))
+    # Stops early, like the Flask route, if the chain is replaced mid-stream
+    blocks = blockchain.linked_blocks(start, end, previous_hash)
+
+    def read() -> bytes:
+        batch = islice(blocks, CHAIN_BATCH)
+        if binary:
+            return b''.join(wire.record(block.encode_binary()) for block in batch)
+        return b', '.join(block.encode() for block in batch)
+
+    async def generate():
+        size = 0
+        if not binary:
+            size += 2
+            yield b'['
+        first = True
+        while True:
+            batch = await run(read)
+            if not batch:
+                break
+            if not first and not binary:
+                batch = b', ' + batch
+            first = False
+            size += len(batch)
+            yield batch
+        if not binary:
+            yield b']'
+        CHAIN_RESPONSE_BYTES.observe(size)
+
+    content_type = wire.MIMETYPE if binary else 'application/json'
+    return Response(generate(), content_type=content_type, headers={'ETag': f'"{tip}"'})
+
+
+@route('/<miner>/transactions')
+async def transactions(request: Request, miner: str):
+    found = await run(blockchain.transactions, miner)
+    return jsonify([dict(transaction) for transaction in found])
+
+
+@route('/<miner>/balance')
+async def balance(request: Request, miner: str):
+    return jsonify(await run(blockchain.balance, miner))
+
+
+@route('/<miner>/sync')
+async def sync(request: Request, miner: str):
+    after = max(request.arg('after', -1, int), -1)
+    return jsonify(await run(blockchain.activity, miner, after, request.args.get('hash')))
+
+
+@route('/block/<int:index>/proof/<transaction_hash>')
+async def inclusion_proof(request: Request, index: int, transaction_hash: str):
+    if not 0 <= index < len(blockchain):
+        return jsonify({'message': "No such block"}, 404)
+
+    if (await run(blockchain.block, index)).pruned:
+        return jsonify({'message': "The block's transactions have been pruned"}, 404)
+
+    proof = await run(blockchain.inclusion_proof, index, transaction_hash)
+    if proof is None:
+        return jsonify({'message': "The block does not hold that transaction"}, 404)
+    return jsonify(proof)
+
+
+@route('/status')
+async def status(request: Request):
+    return jsonify({'length': len(blockchain), 'tip': watcher.tip.hash(), 'work': blockchain.work})
+
+
+@route('/hashes')
+async def block_hashes(request: Request):
+    start = max(request.arg('start', 0, int), 0)
+    end = min(len(blockchain), start + max(request.arg('limit', 1, int), 0))
+    hashes = await run(lambda: [blockchain.block(index).hash() for index in range(start, end)])
+    return jsonify(hashes)
+
+
+@route('/nodes/register', methods=['POST'])
+async def register_nodes(request: Request):
+    nodes = (request.json() or {}).get('nodes')
+    if not isinstance(nodes, list):
+        return jsonify({'message': "Expected a list of 'nodes'"}, 400)
+
+    for node in nodes:
+        blockchain.register_node(node)
+    return jsonify({'nodes': sorted(blockchain.nodes)})
+
+
+@route('/nodes/resolve')
+async def consensus(request: Request):
+    # Downloads and checks peers' blocks, which can take a while
+    replaced = await run(blockchain.resolve_conflicts)
+    tip = await run(lambda: blockchain.last_block.hash())
+    return jsonify({'replaced': replaced, 'length': len(blockchain), 'tip': tip})
+
+
+@route('/last_block')
+async def last_block(request: Request):
+    return block_response(request, watcher.tip, header_only=True)
+
+
+@route('/last_block/wait')
+async def wait_for_block(request: Request):
+    timeout = min(request.arg('timeout', 30, float), 60)
+    block = await watcher.wait(request.args.get('hash'), timeout)
+    return block_response(request, block, header_only=True)
+
+
+@route('/metrics')
+async def metrics(request: Request):
+    return Response(REGISTRY.render().encode('utf-8'), content_type=CONTENT_TYPE)
+
+
+@route('/admin/profile', methods=('GET', 'POST'))
+async def admin_profile(request: Request):
+    """
+    Switches profiling on and off like the Flask app's `/admin/profile`,
+    and likewise only for requests from the node's own host
+    """
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'message': "Profiling can only be switched from the node's host"}, 403)
+
+    if request.method == 'POST':
+        mode = (request.json() or {}).get('mode')
+        if mode == 'off':
+            status = PROFILER.status()
+            # Waits for the call being profiled to finish
+            return jsonify({**status, 'file': await run(PROFILER.stop)})
+        try:
+            PROFILER.start(mode)
+        except ProfilerError as error:
+            return jsonify({'message': str(error)}, 400)
+    return jsonify(PROFILER.status())
+
+
+def match(request: Request) -> Tuple[str, Optional[Callable], dict]:
+    """
+    :return: The matched rule, its handler and the path's parameters. The
+    handler is None if no rule matches, or if one matches another method
+    """
+    allowed = None
+    for method, rule, pattern, handler in routes:
+        found = pattern.match(request.path)
+        if found is None:
+            continue
+        if method == request.method:
+            return rule, handler, found.groupdict()
+        allowed = rule
+    return (allowed or 'unmatched'), None, {}
+
+
+async def read_request(reader: asyncio.StreamReader, remote_addr: str = None) -> Optional[Request]:
+    """
+    :param remote_addr: (Optional) <str> The client's IP address
+    :return: The next request on the connection, or None once the client
+    has closed it
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise BadRequest("Malformed request line")
+
+    headers = {}
+    size = 0
+    while True:
+        line = await reader.readline()
+        size += len(line)
+        if size > MAX_HEADERS:
+            raise BadRequest("Headers too large")
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        body = await read_chunked(reader)
+    else:
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise BadRequest("Malformed Content-Length")
+        if length > MAX_BODY:
+            raise BadRequest("Body too large")
+        body = await reader.readexactly(length) if length > 0 else b''
+    return Request(method, target, version, headers, body, remote_addr)
+
+
+async def read_chunked(reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        line = await reader.readline()
+        try:
+            length = int(line.split(b';')[0], 16)
+        except ValueError:
+            raise BadRequest("Malformed chunk")
+        size += length
+        if size > MAX_BODY:
+            raise BadRequest("Body too large")
+        if length == 0:
+            # Skip any trailers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(length))
+        await reader.readexactly(2)
+
+
+async def write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+    head = [f'HTTP/1.1 {response.status} {REASONS.get(response.status, "Unknown")}',
+            f'Content-Type: {response.content_type}',
+            'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+    head.extend(f'{name}: {value}' for name, value in response.headers.items())
+
+    if isinstance(response.body, bytes):
+        head.append(f'Content-Length: {len(response.body)}')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body)
+        await writer.drain()
+        return
+
+    head.append('Transfer-Encoding: chunked')
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+    async for chunk in response.body:
+        if chunk:
+            writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            # Wait for a slow client to take the chunk before reading more blocks
+            await writer.drain()
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    latency = request_histogram()
+    peer = writer.get_extra_info('peername')
+    remote_addr = peer[0] if peer else None
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader, remote_addr), KEEP_ALIVE)
+            except BadRequest as error:
+                await write_response(writer, jsonify({'message': str(error)}, 400), False)
+                break
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                break
+            if request is None:
+                break
+
+            start = perf_counter()
+            rule, handler, params = match(request)
+            if handler is None:
+                response = jsonify({'message': "Not Found"}, 404 if rule == 'unmatched' else 405)
+            else:
+                try:
+                    response = await handler(request, **params)
+                except Exception:
+                    print_exc()
+                    response = jsonify({'message': "Internal Server Error"}, 500)
+
+            await write_response(writer, response, request.keep_alive)
+            latency.observe(perf_counter() - start, method=request.method, route=rule, status=str(response.status))
+            if not request.keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = '0.0.0.0', port: int = 5000):
+    global watcher
+    watcher = TipWatcher(blockchain, asyncio.get_running_loop())
+    server = await asyncio.start_server(handle_connection, host, port, limit=MAX_LINE, backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+# Run the program on port 5000, or the port given, IE `python3 async_server.py 5001`
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(port=int(argv[1]) if len(argv) > 1 else 5000))
+    except KeyboardInterrupt:
+        pass
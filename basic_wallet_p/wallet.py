@@ -1,7 +1,119 @@
 import requests
+import sys
 
+from hashlib import sha256
+from json import dump, dumps, load
+from os import environ, makedirs, path, replace
 from sys import argv
 
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from core import wire  # noqa: E402
+
+from core.chain import ProofHasher  # noqa: E402
+from core.merkle import verify_proof  # noqa: E402
+
+# Where each address's history is cached between runs
+CACHE_DIR = environ.get('WALLET_CACHE', path.join(path.expanduser('~'), '.blockchain_wallet'))
+
+
+def block_hash(node: str, index: int) -> str:
+    """
+    :return: <str> The hash `node` gives for the block at `index`, IE from a
+    node the wallet trusts more than the one proving a transaction
+    """
+    response = requests.get(url=f"{node}/hashes", params={'start': index, 'limit': 1})
+    response.raise_for_status()
+    return response.json()[0]
+
+
+def verify_inclusion(node: str, index: int, transaction: dict, trusted_hash: str) -> bool:
+    """
+    Checks that a transaction is in the block at `index` using only that
+    block's header and a Merkle proof, without downloading the block.
+
+    Everything in the node's answer is checked against `trusted_hash`: the
+    header must hash to it, the header before it must link to it and meet
+    its proof of work, and only then is the Merkle path checked against the
+    header's root
+
+    :param trusted_hash: <str> The hash of the block at `index` from a source
+    the wallet trusts, IE `block_hash()` of another node, or the cached
+    cursor's hash when `index` is the cursor's height
+    :return: True if the node proved the transaction is in the block
+    """
+    data = dumps(transaction).encode('utf-8')
+    response = requests.get(url=f"{node}/block/{index}/proof/{sha256(data).hexdigest()}")
+    if response.status_code != 200:
+        return False
+
+    inclusion = response.json()
+    header = inclusion['header']
+    if header['index'] != index or sha256(wire.canonical(header)).hexdigest() != trusted_hash:
+        return False
+
+    if index > 0:
+        previous = inclusion.get('previous_header')
+        if previous is None:
+            return False
+        previous_string = wire.canonical(previous)
+        if sha256(previous_string).hexdigest() != header['previous_hash']:
+            return False
+        if not ProofHasher(previous_string.decode('utf-8'), previous['difficulty']).valid(header['proof']):
+            return False
+    return verify_proof(data, inclusion['proof'], header['merkle_root'])
+
+
+def cache_path(node: str, user_id: str) -> str:
+    return path.join(CACHE_DIR, sha256(f'{node} {user_id}'.encode('utf-8')).hexdigest()[:32] + '.json')
+
+
+def load_cache(file: str) -> dict:
+    """
+    :return: <dict> The cached 'transactions', 'balance' and 'cursor', or
+    an empty history if nothing usable is cached
+    """
+    try:
+        with open(file) as f:
+            cache = load(f)
+        if {'transactions', 'balance', 'cursor'} <= set(cache):
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'transactions': [], 'balance': 0, 'cursor': {'height': -1, 'hash': None}}
+
+
+def save_cache(file: str, cache: dict):
+    makedirs(path.dirname(file), exist_ok=True)
+    with open(f'{file}.tmp', 'w') as f:
+        dump(cache, f)
+    replace(f'{file}.tmp', file)
+
+
+def sync(node: str, user_id: str, cache: dict) -> dict:
+    """
+    Brings a cached history up to date with only the transactions in
+    blocks the wallet has not seen. If the node's chain was replaced since
+    the last sync it sends the whole history again and the cache is reset
+
+    :return: <dict> The updated cache
+    """
+    cursor = cache['cursor']
+    params = {'after': cursor['height']}
+    if cursor['hash'] is not None:
+        params['hash'] = cursor['hash']
+    response = requests.get(url=f"{node}/{user_id}/sync", params=params)
+    response.raise_for_status()
+    delta = response.json()
+
+    transactions = [] if delta['reset'] else cache['transactions']
+    return {
+        'transactions': transactions + delta['transactions'],
+        'balance': delta['balance'],
+        'cursor': delta['cursor'],
+    }
+
+
 if __name__ == '__main__':
     # What is the server address? IE `python3 miner.py https://server.com/api/`
     if len(argv) > 1:
@@ -14,19 +126,17 @@ if __name__ == '__main__':
     else:
         node = "http://localhost:5000"
 
+    file = cache_path(node, user_id)
+    cache = load_cache(file)
     try:
-        transactions = requests.get(url=f"{node}/{user_id}/transactions")
-        balance = requests.get(url=f"{node}/{user_id}/balance")
-        try:
-            transactions = transactions.json()
-            balance = balance.json()
-        except ValueError:
-            print("Could not read data from the server...")
-
-        print("Transactions.....")
-        for transaction in transactions:
-            print(transaction)
-        print(f"Your balance is {balance}")
-
+        cache = sync(node, user_id, cache)
+        save_cache(file, cache)
     except requests.exceptions.ConnectionError:
-        pass
+        print("Could not reach the server, showing the cached history...")
+    except (requests.exceptions.HTTPError, ValueError, KeyError):
+        print("Could not read data from the server...")
+
+    print("Transactions.....")
+    for entry in cache['transactions']:
+        print(entry['transaction'])
+    print(f"Your balance is {cache['balance']} as of block {cache['cursor']['height']}")
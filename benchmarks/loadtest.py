@@ -0,0 +1,386 @@
+"""
+Puts a node under load from many clients at once and reports how it holds
+up over time:
+
+* N miners fetch `/last_block`, find a proof and submit it to `/mine`
+* M submitters post transfers to `/new_transaction` (basic_wallet_p only)
+* K wallet readers poll balances, histories and `/chain?since=`
+
+Every client is a thread with its own connection. Difficulty is held low
+so miners race each other and stale proofs show up within seconds.
+
+The node runs in this process by default. `--spawn` starts it on localhost
+instead so its memory is measured on its own, and `--url` points at a node
+that is already running (give `--pid` to sample its memory too).
+
+IE `python3 benchmarks/loadtest.py --app basic_wallet_p --miners 8
+--submitters 4 --readers 16 --duration 300` for a five minute soak. The
+report lists throughput and p50/p99 latency per route, accepted, stale and
+invalid proofs, and the node's resident memory over the run.
+"""
+import logging
+import random
+import subprocess
+import sys
+
+from argparse import SUPPRESS, ArgumentParser
+from array import array
+from collections import defaultdict
+from json import dump
+from math import ceil
+from os import getpid, path
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep, time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+APPS = ('client_mining_p', 'basic_wallet_p')
+
+
+def load_node(app: str, difficulty: int, retarget: bool):
+    """
+    Imports an app's node module with a fresh chain at `difficulty`. Unless
+    `retarget` is set the difficulty stays there however fast blocks come
+    """
+    sys.path.insert(0, path.join(ROOT, app))
+    import blockchain as node
+    from core import chain
+    if not retarget:
+        chain.RETARGET_INTERVAL = 10 ** 9
+    features = node.blockchain
+    node.blockchain = node.app.blockchain = node.Blockchain(transactions=features.with_transactions,
+                                                            wallet=features.with_wallet, difficulty=difficulty)
+    return node
+
+
+class Stats():
+    """
+    Latencies per route and the count of every response status, shared by
+    all the client threads
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies: Dict[str, array] = defaultdict(lambda: array('d'))
+        self.statuses: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def record(self, route: str, seconds: float, status: str):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route, status] += 1
+
+    def request(self, session: requests.Session, method: str, route: str, url: str,
+                **kwargs) -> Optional[requests.Response]:
+        """
+        Sends a request and records it under `route`, the URL's rule such as
+        `GET /<address>/balance`. Connection failures count as status 'error'
+
+        :return: The response, or None if there was none
+        """
+        start = perf_counter()
+        try:
+            response = session.request(method, url, timeout=30, **kwargs)
+            response.content
+        except requests.exceptions.RequestException:
+            self.record(route, perf_counter() - start, 'error')
+            return None
+        self.record(route, perf_counter() - start, str(response.status_code))
+        return response
+
+
+class Pacer():
+    """
+    Spaces out a client's actions at `rate` per second. A rate of 0 or less
+    means as fast as the node answers
+    """
+
+    def __init__(self, rate: float, stop: Event):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.stop = stop
+        self.next = perf_counter()
+
+    def wait(self) -> bool:
+        """
+        :return: False once the run is over
+        """
+        if self.interval:
+            self.next += self.interval
+            delay = self.next - perf_counter()
+            if delay > 0:
+                return not self.stop.wait(delay)
+            # Running behind, so start over from now rather than bursting
+            self.next = perf_counter()
+        return not self.stop.is_set()
+
+
+def mine(node: str, miner_id: str, rate: float, stats: Stats, stop: Event):
+    """
+    Mines like miner.py: a stale proof is answered with the new last block,
+    which is mined on straight away
+    """
+    import miner
+    from core import wire
+    session = requests.Session()
+    pacer = Pacer(rate, stop)
+    tip = None
+    while pacer.wait():
+        if tip is not None:
+            fields, block_string = tip, wire.canonical(tip).decode('utf-8')
+            tip = None
+        else:
+            response = stats.request(session, 'GET', 'GET /last_block', f'{node}/last_block')
+            if response is None or response.status_code != 200:
+                stop.wait(0.1)
+                continue
+            fields, block_string = miner.read_block(response)
+        difficulty = fields.get('difficulty', miner.DIFFICULTY)
+        proof = miner.find_proof(block_string, random.randrange(2 ** 32), None, difficulty)
+        submission = {'proof': proof, 'miner': miner_id, 'previous_hash': miner.block_hash(block_string)}
+        response = stats.request(session, 'POST', 'POST /mine', f'{node}/mine', json=submission)
+        if response is not None and response.status_code == 409:
+            tip = response.json().get('last_block')
+
+
+def submit(node: str, senders: List[str], receivers: int, rate: float, stats: Stats, stop: Event):
+    """
+    Sends small transfers from the miners, who are the only ones with coins
+    """
+    session = requests.Session()
+    pacer = Pacer(rate, stop)
+    while pacer.wait():
+        transaction = {'sender': random.choice(senders), 'receiver': f'load-user-{random.randrange(receivers)}',
+                       'amount': random.randrange(1, 100) / 100}
+        stats.request(session, 'POST', 'POST /new_transaction', f'{node}/new_transaction', json=transaction)
+
+
+def read(node: str, app: str, addresses: List[str], rate: float, stats: Stats, stop: Event):
+    """
+    Polls the way wallets and light clients do: an address's balance, history
+    and cursor sync, and the blocks added since the last poll
+    """
+    session = requests.Session()
+    pacer = Pacer(rate, stop)
+    height = -1
+    cursors = {}
+    routes = ['chain']
+    if app == 'basic_wallet_p':
+        routes += ['balance', 'transactions', 'sync']
+    while pacer.wait():
+        route = random.choice(routes)
+        address = random.choice(addresses)
+        if route == 'chain':
+            response = stats.request(session, 'GET', 'GET /chain?since=', f'{node}/chain', params={'since': height})
+            if response is not None and response.status_code == 200:
+                height += len(response.json())
+        elif route == 'sync':
+            cursor = cursors.get(address, {'height': -1, 'hash': None})
+            response = stats.request(session, 'GET', 'GET /<address>/sync', f'{node}/{address}/sync',
+                                     params={'after': cursor['height'], 'hash': cursor['hash']})
+            if response is not None and response.status_code == 200:
+                cursors[address] = response.json()['cursor']
+        else:
+            stats.request(session, 'GET', f'GET /<address>/{route}', f'{node}/{address}/{route}')
+
+
+def resident_memory(pid: int) -> Optional[int]:
+    """
+    :return: <int> The process's resident set size in bytes, or None where
+    /proc is not available
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def sample_memory(pid: int, every: float, samples: List[Tuple[float, int]], stop: Event):
+    start = perf_counter()
+    while True:
+        rss = resident_memory(pid)
+        if rss is not None:
+            samples.append((perf_counter() - start, rss))
+        if stop.wait(every):
+            break
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of values that are already sorted
+    """
+    return values[max(0, ceil(fraction * len(values)) - 1)]
+
+
+def summarize(stats: Stats, seconds: float, memory: List[Tuple[float, int]]) -> dict:
+    routes = {}
+    for route, latencies in sorted(stats.latencies.items()):
+        ordered = sorted(latencies)
+        statuses = {status: count for (name, status), count in stats.statuses.items() if name == route}
+        routes[route] = {
+            'requests': len(ordered),
+            'per_sec': len(ordered) / seconds,
+            'p50': percentile(ordered, 0.5),
+            'p99': percentile(ordered, 0.99),
+            'statuses': statuses,
+        }
+
+    submissions = routes.get('POST /mine', {}).get('statuses', {})
+    summary = {
+        'seconds': seconds,
+        'requests': sum(route['requests'] for route in routes.values()),
+        'routes': routes,
+        'proofs': {
+            'accepted': submissions.get('200', 0),
+            'stale': submissions.get('409', 0),
+            'invalid': submissions.get('400', 0),
+        },
+    }
+    if memory:
+        (first_time, first), (last_time, last) = memory[0], memory[-1]
+        summary['memory'] = {
+            'start': first,
+            'end': last,
+            'peak': max(rss for _, rss in memory),
+            'growth_per_min': (last - first) / max(last_time - first_time, 1e-9) * 60,
+            'samples': memory,
+        }
+    return summary
+
+
+def report(summary: dict):
+    seconds = summary['seconds']
+    print(f"{summary['requests']:,} requests in {seconds:.1f}s, {summary['requests'] / seconds:,.1f}/s")
+    print(f"{'route':28} {'requests':>9} {'/s':>9} {'p50 ms':>9} {'p99 ms':>9}  statuses")
+    for route, result in summary['routes'].items():
+        statuses = ' '.join(f'{status}={count}' for status, count in sorted(result['statuses'].items()))
+        print(f"{route:28} {result['requests']:9,} {result['per_sec']:9,.1f} {result['p50'] * 1e3:9.2f} "
+              f"{result['p99'] * 1e3:9.2f}  {statuses}")
+
+    proofs = summary['proofs']
+    print(f"Proofs: {proofs['accepted']} accepted ({proofs['accepted'] / seconds:.1f} blocks/s), "
+          f"{proofs['stale']} stale, {proofs['invalid']} invalid")
+
+    memory = summary.get('memory')
+    if memory:
+        mib = 1024 * 1024
+        print(f"Memory: {memory['start'] / mib:.1f} MiB -> {memory['end'] / mib:.1f} MiB, "
+              f"peak {memory['peak'] / mib:.1f} MiB, {memory['growth_per_min'] / mib:+.2f} MiB/min")
+
+
+def start_in_process(app: str, difficulty: int, retarget: bool) -> str:
+    from werkzeug.serving import make_server
+
+    node = load_node(app, difficulty, retarget)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, node.app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def spawn(args) -> Tuple[str, subprocess.Popen]:
+    """
+    Starts the node in its own process on localhost and waits for it to
+    answer
+    """
+    command = [sys.executable, path.abspath(__file__), '--serve', str(args.port), '--app', args.app,
+               '--difficulty', str(args.difficulty)]
+    if args.retarget:
+        command.append('--retarget')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    node = f'http://127.0.0.1:{args.port}'
+    deadline = time() + 30
+    while time() < deadline:
+        try:
+            requests.get(f'{node}/last_block', timeout=1)
+            return node, process
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None:
+                break
+            sleep(0.1)
+    process.kill()
+    sys.exit(f'The node did not start on port {args.port}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Runs miners, transaction submitters and wallet readers against a node")
+    parser.add_argument('--app', choices=APPS, default='basic_wallet_p', help="Which node to run")
+    parser.add_argument('--url', help="Load a node that is already running instead of starting one")
+    parser.add_argument('--pid', type=int, help="With --url, the node's process id to sample its memory")
+    parser.add_argument('--spawn', action='store_true', help="Start the node in its own process on localhost")
+    parser.add_argument('--port', type=int, default=5099, help="Port for --spawn")
+    parser.add_argument('--serve', type=int, metavar='PORT', help=SUPPRESS)
+    parser.add_argument('--difficulty', type=int, default=8, help="Leading zero bits proofs need")
+    parser.add_argument('--retarget', action='store_true', help="Let the difficulty retarget as blocks come")
+    parser.add_argument('--miners', type=int, default=4, help="Simulated miners")
+    parser.add_argument('--submitters', type=int, default=None, help="Transaction submitters (basic_wallet_p)")
+    parser.add_argument('--readers', type=int, default=4, help="Wallet readers")
+    parser.add_argument('--mine-rate', type=float, default=0, help="Proofs per second per miner, 0 for no limit")
+    parser.add_argument('--tx-rate', type=float, default=20, help="Transactions per second per submitter")
+    parser.add_argument('--read-rate', type=float, default=20, help="Reads per second per reader")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run for")
+    parser.add_argument('--sample-every', type=float, default=1, help="Seconds between memory samples")
+    parser.add_argument('--output', help="Where to save the summary as JSON")
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        node = load_node(args.app, args.difficulty, args.retarget)
+        node.app.run(host='127.0.0.1', port=args.serve, threaded=True)
+        sys.exit()
+
+    if args.submitters is None:
+        args.submitters = 2 if args.app == 'basic_wallet_p' else 0
+    if args.submitters and args.app != 'basic_wallet_p':
+        parser.error(f"{args.app} does not take transactions")
+
+    sys.path.insert(0, path.join(ROOT, 'client_mining_p'))
+    process = None
+    if args.url:
+        node, pid = args.url.rstrip('/'), args.pid
+    elif args.spawn:
+        node, process = spawn(args)
+        pid = process.pid
+    else:
+        node, pid = start_in_process(args.app, args.difficulty, args.retarget), getpid()
+
+    stats = Stats()
+    stop = Event()
+    miners = [f'load-miner-{number}' for number in range(args.miners)]
+    addresses = miners + [f'load-user-{number}' for number in range(100)]
+    clients = [Thread(target=mine, args=(node, miner_id, args.mine_rate, stats, stop)) for miner_id in miners]
+    clients += [Thread(target=submit, args=(node, miners, 100, args.tx_rate, stats, stop))
+                for _ in range(args.submitters if miners else 0)]
+    clients += [Thread(target=read, args=(node, args.app, addresses, args.read_rate, stats, stop))
+                for _ in range(args.readers)]
+
+    memory: List[Tuple[float, int]] = []
+    sampler = Thread(target=sample_memory, args=(pid, args.sample_every, memory, stop)) if pid else None
+
+    print(f"Loading {node} with {args.miners} miners, {args.submitters} submitters and {args.readers} readers "
+          f"for {args.duration:.0f}s...")
+    start = perf_counter()
+    for thread in clients + [sampler] * (sampler is not None):
+        thread.start()
+    try:
+        stop.wait(args.duration)
+    except KeyboardInterrupt:
+        print("Stopping early...")
+    stop.set()
+    for thread in clients:
+        thread.join()
+    seconds = perf_counter() - start
+    if sampler is not None:
+        sampler.join()
+    if process is not None:
+        process.terminate()
+
+    summary = summarize(stats, seconds, memory)
+    report(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            dump(summary, f, indent=2, sort_keys=True)
+        print(f'Saved to {args.output}')
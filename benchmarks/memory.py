@@ -0,0 +1,69 @@
+"""
+Compares the memory used by a chain of blocks in the original layout (plain
+objects with a `__dict__` each, transactions in a list) with the slotted,
+column-stored layout in core/chain.py.
+
+IE `python3 benchmarks/memory.py 1000 100` for 1000 blocks of 100 transactions
+"""
+import sys
+import tracemalloc
+
+from os import path
+from sys import argv
+from time import time
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'basic_wallet_p'))
+
+import blockchain  # noqa: E402
+
+ADDRESSES = 1000
+
+
+class LegacyTransaction():
+    def __init__(self, sender: str, receiver: str, amount: float):
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+
+
+class LegacyBlock():
+    def __init__(self, index: int, timestamp: float, proof: int, previous_hash: str, transations, miner: str):
+        self.index = index
+        self.timestamp = timestamp
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.transactions = transations
+        self.miner = miner
+
+
+def build(transaction_class, block_class, blocks: int, per_block: int):
+    # Addresses are built fresh every time, the way parsing request JSON does
+    chain = []
+    for index in range(blocks):
+        transactions = [transaction_class(f'user {(index + n) % ADDRESSES}', f'user {(index * n) % ADDRESSES}', n * 0.5)
+                        for n in range(per_block)]
+        chain.append(block_class(index, time(), index, f'{index:064x}', transactions, f'user {index % ADDRESSES}'))
+    return chain
+
+
+def measure(transaction_class, block_class, blocks: int, per_block: int):
+    tracemalloc.start()
+    chain = build(transaction_class, block_class, blocks, per_block)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del chain
+    return current
+
+
+if __name__ == '__main__':
+    blocks = int(argv[1]) if len(argv) > 1 else 1000
+    per_block = int(argv[2]) if len(argv) > 2 else 100
+
+    legacy = measure(LegacyTransaction, LegacyBlock, blocks, per_block)
+    compact = measure(blockchain.Transaction, blockchain.Block, blocks, per_block)
+    records = blocks * per_block
+
+    print(f'{blocks} blocks x {per_block} transactions')
+    print(f'Legacy:  {legacy / 2 ** 20:8.1f} MiB  {legacy / records:6.1f} bytes/transaction')
+    print(f'Compact: {compact / 2 ** 20:8.1f} MiB  {compact / records:6.1f} bytes/transaction')
+    print(f'Saved:   {1 - compact / legacy:8.1%}')
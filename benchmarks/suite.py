@@ -0,0 +1,210 @@
+"""
+Times the hot paths of a node and a miner and saves the results as JSON so
+runs can be compared:
+
+* `valid_proof` throughput
+* `find_proof` at one or more difficulties
+* `str(block)`, `hash()` and `encode()` on blocks of 10 to 10k transactions
+* `/<address>/balance` latency as the chain grows
+* `/chain` response time and size
+
+HTTP paths go through the Flask test client, so nothing touches the network.
+Inputs are generated from fixed seeds and every case reports the median and
+best of several runs.
+
+IE `python3 benchmarks/suite.py --output results.json` and later
+`python3 benchmarks/suite.py --compare results.json` to flag any case that
+got more than 20% slower than in that run.
+"""
+import gc
+import json
+import platform
+import random
+import sys
+
+from argparse import ArgumentParser
+from os import path
+from statistics import median
+from time import perf_counter, time
+from typing import Callable, Dict, List
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, path.join(ROOT, 'client_mining_p'))
+sys.path.insert(0, path.join(ROOT, 'basic_wallet_p'))
+
+import blockchain as node  # noqa: E402
+import miner  # noqa: E402
+
+ADDRESSES = 1000
+BLOCK_SIZES = (10, 100, 1000, 10000)
+CHAIN_LENGTHS = (10, 100, 1000)
+DIFFICULTIES = (8, 12, 16)
+
+
+def measure(function: Callable[[], object], repeat: int, number: int = 1) -> Dict[str, float]:
+    """
+    Runs `function` `number` times per sample, `repeat` samples, with the
+    garbage collector paused so it does not land in one sample at random
+
+    :return: <dict> The median and best seconds per call
+    """
+    samples = []
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = perf_counter()
+            for _ in range(number):
+                function()
+            samples.append((perf_counter() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+    return {'median': median(samples), 'best': min(samples)}
+
+
+def transactions(count: int, seed: int) -> List:
+    rng = random.Random(seed)
+    return [node.Transaction(f'user {rng.randrange(ADDRESSES)}', f'user {rng.randrange(ADDRESSES)}',
+                             rng.randrange(1, 1000) / 4)
+            for _ in range(count)]
+
+
+def block(size: int, seed: int = 0):
+    return node.Block(1, 1500000000.0, seed, '0' * 64, transactions(size, seed), 'miner')
+
+
+def bench_valid_proof(repeat: int) -> Dict[str, dict]:
+    last_block = block(10)
+    block_string = str(last_block)
+    number = 10000
+    proofs = iter(range(repeat * number))
+    result = measure(lambda: node.Blockchain.valid_proof(block_string, next(proofs), last_block.difficulty),
+                     repeat, number)
+    result['ops_per_sec'] = 1 / result['median']
+    return {'valid_proof': result}
+
+
+def bench_find_proof(difficulties, repeat: int) -> Dict[str, dict]:
+    results = {}
+    for difficulty in difficulties:
+        # Every sample searches a different block so one lucky nonce does not repeat
+        seeds = iter(range(repeat))
+        hashes_before = miner.HASHES.value()
+        result = measure(lambda: miner.find_proof(f'benchmark block {next(seeds)}', 0, None, difficulty), repeat)
+        hashes = miner.HASHES.value() - hashes_before
+        result['hashes_per_sec'] = hashes / (result['median'] * repeat)
+        results[f'find_proof[difficulty={difficulty}]'] = result
+    return results
+
+
+def bench_blocks(sizes, repeat: int) -> Dict[str, dict]:
+    """
+    Blocks cache their serialization and hash, so every sample times a
+    block that was built fresh outside the timer
+    """
+    results = {}
+    for size in sizes:
+        number = max(1, 10000 // size)
+        for name, operation in (('str', str), ('hash', lambda b: b.hash()), ('encode', lambda b: b.encode())):
+            fresh = iter([block(size, seed) for seed in range(repeat * number)])
+            results[f'block.{name}[transactions={size}]'] = measure(lambda: operation(next(fresh)), repeat, number)
+    return results
+
+
+def build_chain(length: int, per_block: int = 10):
+    """
+    A chain of `length` blocks, each holding `per_block` transfers between
+    addresses that were funded by the miner rewards. Proofs are not checked
+    when blocks are appended directly, so no mining is needed
+    """
+    chain = node.Blockchain()
+    rng = random.Random(length)
+    funded = []
+    for index in range(1, length):
+        if funded:
+            chain.new_transactions({'sender': rng.choice(funded), 'receiver': f'user {rng.randrange(ADDRESSES)}',
+                                    'amount': 0.25} for _ in range(per_block))
+        reward = node.Transaction(f'node {index}', f'user {index % 10}', per_block)
+        chain.new_block(index, chain.last_block.hash(), 'miner', reward)
+        funded.append(f'user {index % 10}')
+    return chain
+
+
+def bench_http(lengths, repeat: int) -> Dict[str, dict]:
+    results = {}
+    client = node.app.test_client()
+    original = node.app.blockchain
+    try:
+        for length in lengths:
+            node.app.blockchain = build_chain(length)
+
+            results[f'GET /balance[chain={length}]'] = measure(lambda: client.get('/user 1/balance').data, repeat, 20)
+
+            size = len(client.get('/chain').data)
+            result = measure(lambda: client.get('/chain').data, repeat)
+            result['bytes'] = size
+            results[f'GET /chain[chain={length}]'] = result
+    finally:
+        node.app.blockchain = original
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    :return: <list> A line for every case whose best time got more than
+    `tolerance` slower than in `baseline`. The best of several samples is
+    the least disturbed by whatever else the machine was doing
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['best'], result['best']
+        if after > before * (1 + tolerance):
+            regressions.append(f'{name}: {before * 1e3:.3f}ms -> {after * 1e3:.3f}ms ({after / before - 1:+.0%})')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmarks the node's and miner's hot paths")
+    parser.add_argument('--output', help="Where to save the results as JSON")
+    parser.add_argument('--compare', help="A saved run to check for regressions against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Slowdown that counts as a regression")
+    parser.add_argument('--difficulty', type=int, nargs='+', default=DIFFICULTIES, help="Difficulties for find_proof")
+    parser.add_argument('--repeat', type=int, default=5, help="Samples per case")
+    parser.add_argument('--quick', action='store_true', help="Skip the largest blocks and chains")
+    args = parser.parse_args()
+
+    sizes = BLOCK_SIZES[:-1] if args.quick else BLOCK_SIZES
+    lengths = CHAIN_LENGTHS[:-1] if args.quick else CHAIN_LENGTHS
+
+    results = {}
+    for bench in (lambda: bench_valid_proof(args.repeat),
+                  lambda: bench_find_proof(args.difficulty, args.repeat),
+                  lambda: bench_blocks(sizes, args.repeat),
+                  lambda: bench_http(lengths, args.repeat)):
+        for name, result in bench().items():
+            extra = ''.join(f'  {key}={value:,.0f}' for key, value in result.items() if key not in ('median', 'best'))
+            print(f'{name:40} {result["median"] * 1e3:10.3f}ms  best {result["best"] * 1e3:10.3f}ms{extra}')
+            results[name] = result
+
+    if args.output:
+        run = {
+            'time': time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+        print(f'Saved to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for line in regressions:
+            print(f'Regression: {line}')
+        if regressions:
+            sys.exit(1)
@@ -1,39 +1,202 @@
 import requests
+import sys
 
 from hashlib import sha256
-from json import dumps
+from multiprocessing import Event, Process, Queue
+from os import environ, path
 from sys import argv
-from time import perf_counter
-from typing import List
+from threading import Condition, Thread
+from time import perf_counter, sleep
+from typing import List, Tuple
 
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
 
-def find_proof(block_string: str, starting: int):
+# The core's chain module, not the node's Flask app, so mining never loads Flask
+from core import wire  # noqa: E402
+
+from core.chain import DIFFICULTY, ProofHasher  # noqa: E402
+from core.metrics import Counter, Gauge, Histogram, serve  # noqa: E402
+
+# How many nonces a worker tries before checking whether another worker won
+CHECK_EVERY = 10000
+
+# Served on `MINER_METRICS_PORT` when it is set
+HASHES = Counter('miner_hashes_total', 'Proofs tried')
+HASH_RATE = Gauge('miner_hashes_per_second', 'Hash rate of the last search')
+SEARCHES = Counter('miner_searches_total', 'Searches for a proof, by whether one was found or the tip moved first',
+                   ('result',))
+SUBMIT_SECONDS = Histogram('miner_submit_seconds', 'Time to submit a proof to /mine, by response status', ('status',))
+
+
+def find_proof(block_string: str, starting: int, stop=None, difficulty: int = DIFFICULTY):
+    hasher = ProofHasher(block_string, difficulty)
+    start = perf_counter()
     proof = starting
-    perf_counter()
-    while not valid_proof(block_string, proof):
+    while not hasher.valid(proof):
         proof += 1
-    print(f'Took: {int(perf_counter())}s')
+        if stop is not None and proof % CHECK_EVERY == 0 and stop.is_set():
+            record_search(None, proof - starting, perf_counter() - start)
+            return None
+    record_search(proof, proof - starting + 1, perf_counter() - start)
+
+    return proof
+
+
+def record_search(proof, hashes: int, seconds: float):
+    """
+    Counts a finished search for a proof, which found `proof` or was
+    abandoned when it is None
+    """
+    HASHES.inc(hashes)
+    HASH_RATE.set(hashes / max(seconds, 1e-9))
+    SEARCHES.inc(result='stale' if proof is None else 'found')
+
+
+def search_range(block_string: str, difficulty: int, worker: int, workers: int, found, results):
+    """
+    Worker for `find_proof_parallel`. Walks every `workers`-th nonce
+    starting at `worker`, so the workers cover disjoint parts of the
+    nonce space, and stops as soon as any worker has found a proof.
+
+    Puts `(worker, proof, hashes, seconds)` on `results` when done,
+    with `proof` set to None if another worker won the race.
+    """
+    hasher = ProofHasher(block_string, difficulty)
+    start = perf_counter()
+    proof = worker
+    hashes = 0
+    while not found.is_set():
+        for _ in range(CHECK_EVERY):
+            hashes += 1
+            if hasher.valid(proof):
+                found.set()
+                results.put((worker, proof, hashes, perf_counter() - start))
+                return
+            proof += workers
+
+    results.put((worker, None, hashes, perf_counter() - start))
+
+
+def find_proof_parallel(block_string: str, workers: int, stop=None, difficulty: int = DIFFICULTY):
+    """
+    Searches for a proof using a pool of `workers` processes.
+
+    :param stop: (Optional) <Event> A multiprocessing Event that, once
+    set, makes every worker give up
+
+    :return: A valid proof for the provided block string, or None if the
+    search was stopped
+    """
+    found = Event() if stop is None else stop
+    results = Queue()
+    pool = [Process(target=search_range, args=(block_string, difficulty, worker, workers, found, results), daemon=True)
+            for worker in range(workers)]
+    for process in pool:
+        process.start()
+
+    proof = None
+    total_hashes = 0
+    longest = 0
+    for _ in pool:
+        worker, result, hashes, seconds = results.get()
+        if result is not None and proof is None:
+            proof = result
+        total_hashes += hashes
+        longest = max(longest, seconds)
+        print(f'Worker {worker}: {hashes / max(seconds, 1e-9):,.0f} hashes/sec')
+
+    for process in pool:
+        process.join()
 
+    record_search(proof, total_hashes, longest)
     return proof
 
 
-def valid_proof(block_string: str, proof: int):
+def valid_proof(block_string: str, proof: int, difficulty: int = DIFFICULTY):
     """
-    Validates the Proof:  Does hash(block_string, proof) contain 3
-    leading zeroes?  Return true if the proof is valid
+    Validates the Proof:  Does hash(block_string, proof) start with
+    `difficulty` zero bits?  Return true if the proof is valid
 
     :param block_string: <string> The stringified block to use to
     check in combination with `proof`
 
     :param proof: <int?> The value that when combined with the
     stringified previous block results in a hash that has the
-    correct number of leading zeroes.
+    correct number of leading zero bits.
+
+    :param difficulty: <int> The leading zero bits the previous block
+    asks for
 
     :return: True if the resulting hash is a valid proof, False otherwise
     """
-    work = f'{block_string} {proof}'.encode('utf-8')
-    hashed = sha256(work).hexdigest()
-    return hashed[0:6] == "000000"
+    return ProofHasher(block_string, difficulty).valid(proof)
+
+
+def read_block(response: requests.Response) -> Tuple[dict, str]:
+    """
+    :return: The block a node sent and the exact string its proof must be
+    found for. A JSON body already is that string, so it is hashed as sent
+    instead of being parsed and dumped again. A binary one is turned back
+    into it by `wire.canonical`, the same way the node builds it
+    """
+    if response.headers.get('Content-Type', '').startswith(wire.MIMETYPE):
+        block = wire.decode_block(response.content)
+        return block, wire.canonical(block).decode('utf-8')
+    return response.json(), response.content.decode('utf-8')
+
+
+def block_hash(block_string: str):
+    return sha256(block_string.encode('utf-8')).hexdigest()
+
+
+class TipWatcher():
+    """
+    Long-polls the node from one thread with its own Session for as long as
+    the miner runs, following whichever block is being mined. `follow` hands
+    out an Event for each search, which is set once the chain moves past
+    that search's block so the search is abandoned. A poll for a block the
+    miner has since left is only used to start polling for the new one.
+    """
+
+    def __init__(self, node: str, timeout: float = 30):
+        self.node = node
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.changed = Condition()
+        self.tip = None
+        self.stale = None
+        Thread(target=self.run, daemon=True).start()
+
+    def follow(self, tip: str):
+        """
+        :param tip: <str> The hash of the block a new search extends
+        :return: <Event> A multiprocessing Event set once `tip` is stale
+        """
+        with self.changed:
+            self.tip = tip
+            self.stale = Event()
+            self.changed.notify()
+            return self.stale
+
+    def run(self):
+        while True:
+            with self.changed:
+                while self.tip is None or self.stale.is_set():
+                    self.changed.wait()
+                tip, stale = self.tip, self.stale
+
+            try:
+                response = self.session.get(url=self.node + "/last_block/wait",
+                                            params={"hash": tip, "timeout": self.timeout},
+                                            headers={"Accept": wire.MIMETYPE}, timeout=self.timeout + 5)
+                _, block_string = read_block(response)
+            except (requests.exceptions.RequestException, ValueError, wire.WireError):
+                # Keep following the tip once the node is back
+                sleep(1)
+                continue
+
+            if block_hash(block_string) != tip:
+                stale.set()
 
 
 if __name__ == '__main__':
@@ -43,38 +206,76 @@ if __name__ == '__main__':
     else:
         node = "http://localhost:5000"
 
+    # How many processes should mine? IE `python3 miner.py http://localhost:5000 4`
+    if len(argv) > 2:
+        workers = int(argv[2])
+    else:
+        workers = 1
+
     # Load ID
     f = open("my_id.txt", "r")
     my_id = f.read()
     print("ID:", my_id)
     f.close()
 
+    # Export the miner's counters, IE `MINER_METRICS_PORT=9100 python3 miner.py`
+    if 'MINER_METRICS_PORT' in environ:
+        serve(int(environ['MINER_METRICS_PORT']))
+
     coins_mined = 0
+    session = requests.Session()
+    watcher = TipWatcher(node)
+
+    # A block the node sent back with a rejected proof, to mine on next
+    tip = None
 
     while True:
 
         try:
-            request = requests.get(url=node + "/last_block")
+            if tip is not None:
+                data, block_string = tip, wire.canonical(tip).decode('utf-8')
+                tip = None
+            else:
+                request = session.get(url=node + "/last_block", headers={"Accept": wire.MIMETYPE})
 
-            try:
-                data = request.json()
-            except ValueError:
-                print("Error:  Non-json response")
-                print("Response returned:")
-                print(request)
-                break
+                try:
+                    data, block_string = read_block(request)
+                except (ValueError, wire.WireError):
+                    print("Error:  Unreadable response")
+                    print("Response returned:")
+                    print(request)
+                    break
 
+            # Every block names the difficulty of the proof that extends it
+            difficulty = data.get('difficulty', DIFFICULTY)
             print("================")
-            print("Mining...")
-            proof = find_proof(dumps(data), 0)
+            print(f"Mining at difficulty {difficulty}...")
+            stale = watcher.follow(block_hash(block_string))
+            if workers > 1:
+                proof = find_proof_parallel(block_string, workers, stale, difficulty)
+            else:
+                proof = find_proof(block_string, 0, stale, difficulty)
+
+            stale_searches = SEARCHES.value(result='stale')
+            searches = stale_searches + SEARCHES.value(result='found')
+            print(f"{HASH_RATE.value():,.0f} hashes/sec, {stale_searches}/{searches} searches went stale")
+            if proof is None:
+                print("Someone else mined this block, starting over...")
+                continue
+            stale.set()
 
             try:
-                request = requests.post(
-                    url=node + "/mine", json={"proof": proof, "miner": my_id})
+                start = perf_counter()
+                submission = {"proof": proof, "miner": my_id, "previous_hash": block_hash(block_string)}
+                request = session.post(url=node + "/mine", json=submission)
+                SUBMIT_SECONDS.observe(perf_counter() - start, status=str(request.status_code))
                 data = request.json()
 
-                if (data != "Invalid Proof"):
+                if request.status_code == 200:
                     coins_mined += 1
+                elif request.status_code == 409 and isinstance(data, dict) and 'last_block' in data:
+                    print(f"{data['message']}, starting on the new last block...")
+                    tip = data['last_block']
                 print(f"You now have {coins_mined} coins!")
 
             except requests.exceptions.ConnectionError:
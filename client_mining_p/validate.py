@@ -0,0 +1,168 @@
+"""
+Checks a whole chain: every block's `previous_hash` must be the hash of the
+block before it, its proof must be valid for that block and, on a chain
+with transactions, its Merkle root must be the root of its transactions.
+A block's hash and proof cover its header when it has a Merkle root and
+the whole block otherwise, the same as the node.
+
+Each block only depends on the serialized bytes of the block before it, so
+the chain is cut into ranges that are checked in parallel by a process pool.
+
+IE `python3 validate.py http://localhost:5000` to check a node's chain, or
+`python3 validate.py data/chain` to check a chain stored with
+`BLOCKCHAIN_PATH=data/chain`. An optional second argument sets the number of
+worker processes.
+"""
+import requests
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from json import dumps, loads
+from os import cpu_count, path
+from sys import argv, exit
+from time import perf_counter
+from typing import List, Optional, Sequence
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from core import merkle, wire  # noqa: E402
+
+# The node's own rules, so the two can not drift apart
+from core.chain import DIFFICULTY, RETARGET_INTERVAL, ProofHasher, Transaction, retarget  # noqa: E402
+from core.storage import LogStorage  # noqa: E402
+
+
+def hashed_bytes(block: bytes, fields: dict) -> bytes:
+    """
+    :return: <bytes> What the block's hash and the next block's proof are
+    computed over: its header on a chain with transactions, or all of it
+    """
+    if 'merkle_root' not in fields:
+        return block
+    return wire.canonical({key: value for key, value in fields.items() if key != 'transations'})
+
+
+def valid_root(fields: dict) -> bool:
+    """
+    :return: True if the block has no Merkle root, its transactions were
+    pruned, or its root is the root of its transactions and none of them is
+    repeated
+    """
+    if 'merkle_root' not in fields:
+        return True
+    transactions = fields.get('transations', [])
+    if not transactions and fields['merkle_root'] != merkle.EMPTY_ROOT:
+        return True
+    leaves = [merkle.leaf(str(Transaction(transaction['sender'], transaction['receiver'], transaction['amount']))
+                          .encode('utf-8')) for transaction in transactions]
+    if len(set(leaves)) != len(leaves):
+        return False
+    return merkle.merkle_root(leaves) == fields['merkle_root']
+
+
+def validate_range(blocks: List[bytes], first: int, start: int) -> Optional[int]:
+    """
+    Checks every block from chain index `start` on against the blocks
+    before it: its index, its `previous_hash` link, its difficulty, its
+    proof, which must meet the difficulty the block before it asks for, and
+    its Merkle root
+
+    :param blocks: <list> Serialized blocks from chain index `first` on. They
+    start RETARGET_INTERVAL blocks before `start` so retargets can be checked
+    :param first: <int> The chain index of `blocks[0]`
+    :param start: <int> The chain index of the first block to check
+
+    :return: The chain index of the first invalid block, or None
+    """
+    parsed = [loads(block) for block in blocks]
+    for index in range(start, first + len(blocks)):
+        offset = index - first
+        previous, block = parsed[offset - 1], parsed[offset]
+        previous_bytes = hashed_bytes(blocks[offset - 1], previous)
+        if block['index'] != index or block['previous_hash'] != sha256(previous_bytes).hexdigest():
+            return index
+
+        difficulty = previous.get('difficulty', DIFFICULTY)
+        expected = difficulty
+        if index % RETARGET_INTERVAL == 0:
+            expected = retarget(difficulty, block['timestamp'] - parsed[offset - RETARGET_INTERVAL]['timestamp'])
+        if block.get('difficulty', DIFFICULTY) != expected:
+            return index
+
+        if not ProofHasher(previous_bytes.decode('utf-8'), difficulty).valid(block['proof']):
+            return index
+
+        if not valid_root(block):
+            return index
+    return None
+
+
+def validate_chain(blocks: Sequence[bytes], workers: int = None) -> Optional[int]:
+    """
+    Validates a chain of serialized blocks across a pool of processes
+
+    :param blocks: <sequence> Every block's serialized bytes, in chain order
+    :param workers: (Optional) <int> Number of processes, one per CPU by default
+
+    :return: The index of the first invalid block, or None if the chain is valid
+    """
+    if blocks and not valid_root(loads(blocks[0])):
+        return 0
+
+    workers = workers or cpu_count() or 1
+    chunk = max(1, min(1000, len(blocks) // (workers * 4)))
+    starts = range(1, len(blocks), chunk)
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = []
+        for start in starts:
+            first = max(0, start - RETARGET_INTERVAL)
+            futures.append(pool.submit(validate_range, list(blocks[first:start + chunk]), first, start))
+
+        # Ranges are checked in chain order, so the first failure is the lowest index
+        for future in futures:
+            invalid = future.result()
+            if invalid is not None:
+                for pending in futures:
+                    pending.cancel()
+                return invalid
+    return None
+
+
+def load_blocks(source: str) -> List[bytes]:
+    """
+    Reads every block's serialized bytes from a node URL or a storage path
+    """
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(url=source.rstrip('/') + "/chain", headers={'Accept': wire.MIMETYPE}, stream=True)
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith(wire.MIMETYPE):
+            records = wire.read_records(response.iter_content(chunk_size=1 << 16))
+            return [wire.canonical(wire.decode_block(record)) for record in records]
+        return [dumps(block).encode('utf-8') for block in response.json()]
+
+    if not path.exists(f'{source}.log'):
+        raise FileNotFoundError(f'No chain stored at {source}')
+    storage = LogStorage(source, bytes)
+    try:
+        return [storage.raw(index) for index in range(len(storage))]
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    source = argv[1] if len(argv) > 1 else "http://localhost:5000"
+    workers = int(argv[2]) if len(argv) > 2 else None
+
+    blocks = load_blocks(source)
+    start = perf_counter()
+    invalid = validate_chain(blocks, workers)
+    seconds = perf_counter() - start
+
+    print(f"Checked {len(blocks)} blocks in {seconds:.2f}s ({len(blocks) / max(seconds, 1e-9):,.0f} blocks/sec)")
+    if invalid is None:
+        print("The chain is valid")
+    else:
+        print(f"Block {invalid} is invalid")
+        exit(1)
@@ -0,0 +1,12 @@
+"""
+The code the four nodes share, importable as a library:
+
+* `core.chain` holds transactions, blocks, proofs of work and `Blockchain`
+* `core.node` builds the Flask app in front of a chain
+* `core.api` holds what every HTTP front end shares without Flask
+* `core.storage`, `core.wire`, `core.metrics`, `core.profiling` and the rest
+  are the pieces those are built from
+
+Importing the package loads none of its modules, and only `core.node`
+imports Flask, so a miner or validator that uses `core.chain` starts fast.
+"""
@@ -0,0 +1,74 @@
+"""
+What a node's HTTP front ends share without a web framework: the metrics
+they export, opening the chain the way the environment asks and the bodies
+of responses both the Flask app in node.py and basic_wallet_p's asyncio
+server send.
+"""
+from atexit import register
+from json import loads
+from typing import Callable, Mapping
+
+from .chain import DIFFICULTY, SNAPSHOT_EVERY, Block, Blockchain, block_class
+from .metrics import REGISTRY, SIZE_BUCKETS, Counter, Gauge, Histogram, Registry
+from .profiling import configure
+from .storage import LogStorage
+
+# Exported on /metrics
+MINE_SUBMISSIONS = Counter('mine_submissions_total', 'Proofs submitted to /mine, or blocks mined by it, by result',
+                           ('result',))
+MINE_REJECTIONS = Counter('mine_rejections_total', 'Proofs sent to /mine that were turned away before being checked, '
+                          'by reason', ('reason',))
+PROOF_OF_WORK_SECONDS = Histogram('proof_of_work_seconds', 'Time spent searching for a proof on the node',
+                                  buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+CHAIN_RESPONSE_BYTES = Histogram('chain_response_bytes', 'Size of /chain responses', buckets=SIZE_BUCKETS)
+
+
+def open_chain(environ: Mapping[str, str], transactions: bool = True, wallet: bool = True,
+               difficulty: int = DIFFICULTY) -> Blockchain:
+    """
+    Starts profiling if `PROFILE` is set and opens the chain:
+
+    * `BLOCKCHAIN_PATH=data/chain` keeps it on disk between restarts
+    * `SNAPSHOT_PATH=data/snapshot.json` snapshots a wallet's balances and
+      headers every `SNAPSHOT_EVERY` blocks and starts from the snapshot
+      next time. `PRUNE=1` also drops the transactions the snapshot covers
+
+    :param environ: <dict> The environment, IE `os.environ`
+    """
+    configure(environ)
+
+    if 'BLOCKCHAIN_PATH' in environ:
+        storage = LogStorage(environ['BLOCKCHAIN_PATH'], block_class(transactions).decode)
+        register(storage.close)
+    else:
+        storage = None
+    if not wallet:
+        return Blockchain(storage, transactions, wallet, difficulty)
+    return Blockchain(storage, transactions, wallet, difficulty, snapshot_path=environ.get('SNAPSHOT_PATH'),
+                      snapshot_every=int(environ.get('SNAPSHOT_EVERY', SNAPSHOT_EVERY)), prune='PRUNE' in environ)
+
+
+def gauges(current: Callable[[], Blockchain], registry: Registry = REGISTRY):
+    """
+    Exports the length and mempool size of the chain `current` returns. Only
+    the first call in a process registers them
+    """
+    if registry.get('chain_length') is None:
+        Gauge('chain_length', 'Blocks in the chain', lambda: len(current().chain), registry)
+        Gauge('mempool_transactions', 'Transactions waiting to go into a block', lambda: len(current().mempool),
+              registry)
+
+
+def parse_line(line: bytes):
+    try:
+        return loads(line)
+    except ValueError:
+        return None
+
+
+def rejection(message: str, tip: Block) -> dict:
+    """
+    Refuses a proof with the current last block, so the miner can start on
+    it without asking for `/last_block`
+    """
+    return {'message': message, 'last_block': dict(tip.header())}
@@ -0,0 +1,1150 @@
+"""
+The chain itself: transactions, blocks, proofs of work and the `Blockchain`
+every node is built on. Nothing here imports Flask or requests, so miners
+and validators can use it as a library.
+
+A `Blockchain` is switched between what the four nodes need with two flags:
+
+* `transactions` keeps a mempool and commits to each block's transactions
+  through a Merkle root in its header. Without it blocks carry no
+  transactions and their hash covers the whole block, `PlainBlock`
+* `wallet` also keeps the address index behind balances and histories,
+  snapshots of it, and syncing with peers
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from array import array
+from json import dumps, loads
+from os import path, replace
+from hashlib import sha256
+from math import inf, log2, nextafter
+from threading import Condition, Lock, Thread
+from time import time
+
+from . import merkle, wire
+
+from .locks import ReadWriteLock
+from .mempool import Mempool, MempoolError, check
+from .metrics import Histogram
+from .profiling import PROFILER
+
+# Leading zero bits a proof's hash needs on a new chain
+DIFFICULTY = 24
+
+# Difficulty is retargeted every RETARGET_INTERVAL blocks so that a block is
+# found about every BLOCK_TIME seconds
+RETARGET_INTERVAL = 10
+BLOCK_TIME = 60
+
+# Most seconds a peer's block may be ahead of this node's clock
+MAX_FUTURE_SECONDS = 10 * BLOCK_TIME
+
+# What a block pays its miner, from the address `node <index>`
+REWARD = 1
+
+# Most pending transactions a node holds, and most that go into one block
+MEMPOOL_SIZE = 100000
+BLOCK_TRANSACTIONS = 1000
+
+# How many blocks apart snapshots of the derived state are taken
+SNAPSHOT_EVERY = 1000
+
+# Most proofs remembered for one tip, to answer the same proof sent twice
+# without hashing it again
+MAX_SUBMISSIONS = 100000
+
+# Exported on /metrics
+VALID_PROOF_SECONDS = Histogram('valid_proof_seconds', 'Time spent checking a proof',
+                                buckets=(1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3))
+
+
+class Transaction():
+    __slots__ = ('sender', 'receiver', 'amount', 'frozen')
+
+    def __init__(self, sender: str, receiver: str, amount: float):
+        # Blocks hand whole amounts back as ints, so they are ints from the
+        # start and a transaction hashes the same in the mempool and a block
+        if isinstance(amount, float) and amount.is_integer():
+            amount = int(amount)
+        self.sender = sender
+        self.receiver = receiver
+        self.amount = amount
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError("Transactions can not be changed once created")
+        super().__setattr__(name, value)
+
+    def __iter__(self):
+        yield "amount", self.amount
+        yield "receiver", self.receiver
+        yield "sender", self.sender
+
+    def __str__(self):
+        return dumps(dict(self))
+
+    def hash(self):
+        """
+        Creates a SHA-256 hash of a Transaction
+        """
+        return sha256(str(self).encode('utf-8')).hexdigest()
+
+
+class Addresses():
+    """
+    Interns address strings as small integer ids so a block's transactions
+    can store them in integer arrays instead of one string per reference
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.lock = Lock()
+
+    def id(self, address: str) -> int:
+        ident = self.ids.get(address)
+        if ident is None:
+            with self.lock:
+                ident = self.ids.get(address)
+                if ident is None:
+                    ident = self.ids[address] = len(self.names)
+                    self.names.append(address)
+        return ident
+
+
+addresses = Addresses()
+
+
+class Transactions():
+    """
+    A block's transactions stored column-wise: sender and receiver ids in
+    integer arrays and amounts in an `array('d')`. Indexing or iterating
+    hands back `Transaction` views, so it reads like the tuple it replaces.
+    Whole amounts come back as ints so the block serializes as it always has.
+    """
+    __slots__ = ('senders', 'receivers', 'amounts')
+
+    def __init__(self, transactions: Iterable[Transaction] = ()):
+        self.senders = array('I')
+        self.receivers = array('I')
+        self.amounts = array('d')
+        for transaction in transactions:
+            self.senders.append(addresses.id(transaction.sender))
+            self.receivers.append(addresses.id(transaction.receiver))
+            self.amounts.append(transaction.amount)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __getitem__(self, position: int) -> Transaction:
+        amount = self.amounts[position]
+        if amount.is_integer():
+            amount = int(amount)
+        return Transaction(addresses.names[self.senders[position]], addresses.names[self.receivers[position]], amount)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def rows(self) -> Iterator[Tuple[str, str, float]]:
+        """
+        `(sender, receiver, amount)` for every transaction, straight from
+        the columns without building Transaction objects
+        """
+        names = addresses.names
+        return zip(map(names.__getitem__, self.senders), map(names.__getitem__, self.receivers), self.amounts)
+
+
+# Shared by every pruned block
+NO_TRANSACTIONS = Transactions()
+
+
+class ProofHasher():
+    """
+    Checks proofs against a single block string. The constant
+    `block_string + ' '` prefix is hashed once and every proof only feeds
+    its own digits into a copy of that midstate. Difficulty is the number
+    of leading zero bits the digest needs, checked on the raw bytes.
+    """
+
+    def __init__(self, block_string: str, difficulty: int = DIFFICULTY):
+        self.midstate = sha256(f'{block_string} '.encode('utf-8'))
+        self.zero_bytes, bits = divmod(difficulty, 8)
+        self.target = bytes(self.zero_bytes)
+        # The first byte that is not all zero bits must be below this
+        self.limit = 0x100 >> bits
+
+    def valid(self, proof: int) -> bool:
+        hashed = self.midstate.copy()
+        hashed.update(str(proof).encode('utf-8'))
+        digest = hashed.digest()
+        if digest[:self.zero_bytes] != self.target:
+            return False
+        return digest[self.zero_bytes] < self.limit
+
+
+def retarget(difficulty: int, elapsed: float) -> int:
+    """
+    Adjusts the difficulty after the last RETARGET_INTERVAL blocks took
+    `elapsed` seconds. Every bit doubles the work, so the difficulty moves by
+    the log2 of how far off BLOCK_TIME the blocks were, by 2 bits at most.
+    """
+    expected = RETARGET_INTERVAL * BLOCK_TIME
+    shift = round(log2(expected / max(elapsed, 1e-3)))
+    return max(1, difficulty + max(-2, min(2, shift)))
+
+
+class Block():
+    """
+    A block's hash and proof of work only cover its header. The header
+    commits to the transactions through their Merkle root, so hashing a
+    block costs the same however many transactions it holds.
+    """
+    __slots__ = ('index', 'timestamp', 'proof', 'previous_hash', 'transactions', 'miner', 'difficulty', 'merkle_root',
+                 'encoded', 'encoded_header', 'hashed', 'frozen')
+
+    def __init__(self, index: int, timestamp: float, proof: int, previous_hash: str, transations: List[Transaction], miner: str,
+                 difficulty: int = DIFFICULTY, merkle_root: str = None):
+        self.index = index
+        self.timestamp = timestamp
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.transactions = transations if isinstance(transations, Transactions) else Transactions(transations)
+        self.miner = miner
+        self.difficulty = difficulty
+        self.merkle_root = merkle_root or merkle.merkle_root(self.leaves())
+        self.encoded = None
+        self.encoded_header = None
+        self.hashed = None
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError("Blocks can not be changed once created")
+        super().__setattr__(name, value)
+
+    def header(self):
+        yield "difficulty", self.difficulty
+        yield "index", self.index
+        yield "merkle_root", self.merkle_root
+        yield "miner", self.miner
+        yield "previous_hash", self.previous_hash
+        yield "proof", self.proof
+        yield "timestamp", self.timestamp
+
+    def __iter__(self):
+        yield from self.header()
+        yield "transations", [dict(transaction) for transaction in self.transactions]
+
+    def __str__(self):
+        return self.encode_header().decode('utf-8')
+
+    def encode(self) -> bytes:
+        """
+        The canonical serialization of a whole Block, computed once
+        """
+        if self.encoded is None:
+            object.__setattr__(self, 'encoded', wire.canonical(dict(self)))
+        return self.encoded
+
+    def encode_header(self) -> bytes:
+        """
+        The canonical serialization of a Block's header, computed once
+        """
+        if self.encoded_header is None:
+            object.__setattr__(self, 'encoded_header', wire.canonical(dict(self.header())))
+        return self.encoded_header
+
+    @classmethod
+    def from_header(cls, fields: dict):
+        """
+        Rebuilds a pruned Block, one without its transactions, from the
+        fields of its header
+        """
+        return cls(fields['index'], fields['timestamp'], fields['proof'], fields['previous_hash'], NO_TRANSACTIONS,
+                   fields['miner'], fields['difficulty'], fields['merkle_root'])
+
+    def prune(self):
+        """
+        A copy of the Block that only keeps its header, which still hashes
+        and links the same way
+        """
+        block = Block.from_header(dict(self.header()))
+        object.__setattr__(block, 'encoded_header', self.encoded_header)
+        object.__setattr__(block, 'hashed', self.hashed)
+        return block
+
+    @property
+    def pruned(self) -> bool:
+        return not self.transactions and self.merkle_root != merkle.EMPTY_ROOT
+
+    def encode_binary(self, header_only: bool = False) -> bytes:
+        """
+        The Block in the binary wire encoding, for clients that ask for it
+        """
+        if header_only:
+            return wire.encode_block(dict(self.header()))
+        return wire.encode_block(dict(self.header()), self.transactions.rows())
+
+    @classmethod
+    def decode(cls, data: bytes):
+        """
+        Rebuilds a Block from the bytes produced by `encode`
+        """
+        fields = loads(data)
+        block = cls(fields['index'], fields['timestamp'], fields['proof'], fields['previous_hash'],
+                    [Transaction(**transaction) for transaction in fields['transations']], fields['miner'],
+                    fields.get('difficulty', DIFFICULTY), fields['merkle_root'])
+        object.__setattr__(block, 'encoded', bytes(data))
+        return block
+
+    def leaves(self) -> List[bytes]:
+        return [merkle.leaf(str(transaction).encode('utf-8')) for transaction in self.transactions]
+
+    def hash(self):
+        """
+        Creates a SHA-256 hash of a Block's header
+        """
+        if self.hashed is None:
+            object.__setattr__(self, 'hashed', sha256(self.encode_header()).hexdigest())
+        return self.hashed
+
+
+class PlainBlock():
+    """
+    A block of a chain without transactions. Its hash and proof of work
+    cover the whole block, which is also its header, and the transactions
+    it was given are kept as a plain tuple.
+    """
+    __slots__ = ('index', 'timestamp', 'proof', 'previous_hash', 'transactions', 'miner', 'difficulty', 'encoded',
+                 'hashed', 'frozen')
+
+    def __init__(self, index: int, timestamp: float, proof: int, previous_hash: str, transations: List[float], miner: str,
+                 difficulty: int = DIFFICULTY):
+        self.index = index
+        self.timestamp = timestamp
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.transactions = tuple(transations)
+        self.miner = miner
+        self.difficulty = difficulty
+        self.encoded = None
+        self.hashed = None
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError("Blocks can not be changed once created")
+        super().__setattr__(name, value)
+
+    def __iter__(self):
+        yield "difficulty", self.difficulty
+        yield "index", self.index
+        yield "miner", self.miner
+        yield "previous_hash", self.previous_hash
+        yield "proof", self.proof
+        yield "timestamp", self.timestamp
+        yield "transations", self.transactions
+
+    def header(self):
+        yield from self
+
+    def __str__(self):
+        return self.encode().decode('utf-8')
+
+    def encode(self) -> bytes:
+        """
+        The canonical serialization of a Block, computed once
+        """
+        if self.encoded is None:
+            object.__setattr__(self, 'encoded', wire.canonical(dict(self)))
+        return self.encoded
+
+    encode_header = encode
+
+    pruned = False
+
+    def encode_binary(self, header_only: bool = False) -> bytes:
+        """
+        The Block in the binary wire encoding, for clients that ask for it.
+        The whole block is its header, so `header_only` changes nothing
+        """
+        fields = dict(self)
+        transactions = fields.pop('transations')
+        return wire.encode_block(fields, listed=list(transactions))
+
+    @classmethod
+    def decode(cls, data: bytes):
+        """
+        Rebuilds a Block from the bytes produced by `encode`. Blocks stored
+        before blocks had a miner decode with None
+        """
+        fields = loads(data)
+        block = cls(fields['index'], fields['timestamp'], fields['proof'], fields['previous_hash'],
+                    fields['transations'], fields.get('miner'), fields.get('difficulty', DIFFICULTY))
+        object.__setattr__(block, 'encoded', bytes(data))
+        return block
+
+    def hash(self):
+        """
+        Creates a SHA-256 hash of a Block
+        """
+        if self.hashed is None:
+            object.__setattr__(self, 'hashed', sha256(self.encode()).hexdigest())
+        return self.hashed
+
+
+def block_class(transactions: bool = True):
+    """
+    :return: The Block class of a chain with or without transactions
+    """
+    return Block if transactions else PlainBlock
+
+
+class StaleBlockError(Exception):
+    """
+    Raised when a new block's previous hash is no longer the last block's hash
+    """
+
+
+class InvalidBlockError(Exception):
+    """
+    Raised when a block from a peer does not follow from the block before it
+    """
+
+
+class Blockchain(object):
+    def __init__(self, storage=None, transactions: bool = True, wallet: bool = True, difficulty: int = DIFFICULTY,
+                 mempool_size: int = MEMPOOL_SIZE, block_transactions: int = BLOCK_TRANSACTIONS,
+                 snapshot_path: str = None, snapshot_every: int = SNAPSHOT_EVERY, prune: bool = False):
+        """
+        :param storage: (Optional) <LogStorage> Where the blocks are kept,
+        decoding them with `block_class(transactions).decode`. In memory
+        when not given
+        :param transactions: (Optional) <bool> Take transactions into
+        blocks from a mempool. Without them blocks are `PlainBlock`s
+        :param wallet: (Optional) <bool> Keep the address index for balances
+        and histories, and allow snapshots and syncing with peers. Needs
+        `transactions`
+        :param difficulty: (Optional) <int> The difficulty of a new chain
+        :param snapshot_path: (Optional) <str> Where to keep a snapshot of
+        the balances and block headers. The node starts from it when it
+        exists and refreshes it every `snapshot_every` blocks. Needs `wallet`
+        :param prune: (Optional) <bool> Drop the transactions of blocks a
+        snapshot covers, keeping only their headers
+        """
+        if wallet and not transactions:
+            raise ValueError("A wallet needs a chain with transactions")
+        if snapshot_path and not wallet:
+            raise ValueError("Snapshots hold the wallet's balances, so they need a wallet")
+
+        self.with_transactions = transactions
+        self.with_wallet = wallet
+        self.block_class = block_class(transactions)
+        self.difficulty = difficulty
+        self.chain: List[Block] = [] if storage is None else storage
+        self.lock = ReadWriteLock()
+        self.tip_changed = Condition()
+        # Proofs already sent for the block at the tip, and what came of
+        # them: 'pending' while checked, then 'invalid' or 'accepted'
+        self.submitted_tip: str = None
+        self.submitted: Dict[str, str] = {}
+        self.submitted_lock = Lock()
+        self.balances: Dict[str, float] = defaultdict(int)
+        self.history: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.mempool = Mempool(mempool_size, (lambda address: self.balances.get(address, 0)) if wallet else None)
+        self.block_transactions = block_transactions
+        self.nodes: Set[str] = set()
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.pruning = prune
+        self.checkpointing = Lock()
+        # Blocks below this are covered by a snapshot: they are not in the
+        # address history, may have no transactions and can not be replaced
+        self.pruned_height = 0
+        # The proof of work behind the whole chain, which wallets sync by
+        self.work = 0
+
+        # How many blocks the snapshot's headers already counted the work of
+        counted = 0
+        if snapshot_path and path.exists(snapshot_path):
+            counted = self.restore(self.load_snapshot(snapshot_path))
+        if wallet:
+            for index in range(self.pruned_height, len(self.chain)):
+                self.index_block(self.chain[index])
+            self.work += self.work_between(counted, len(self.chain))
+        if not self.chain:
+            self.new_block(proof="100")
+
+    @PROFILER.section('new_block')
+    def new_block(self, proof: int, previous_hash: str = None, miner: str = None, reward: Transaction = None):
+        """
+        Create a new Block in the Blockchain
+
+        A block should have:
+        * Index
+        * Timestamp
+        * Up to `block_transactions` of the oldest pending transactions, on
+          a chain with transactions
+        * The proof used to mine this block
+        * The hash of the previous block
+
+        :param proof: <int> The proof given by the Proof of Work algorithm
+        :param previous_hash: (Optional) <str> Hash of previous Block. The
+        block is only added while this is still the last block's hash
+        :param miner: (Optional) <str> Who found the proof
+        :param reward: (Optional) <Transaction> The miner's reward, on a
+        chain with transactions
+        :return: <dict> New Block
+        """
+        if proof is None:
+            raise Exception("Proof of work is required to create a new block!")
+
+        with self.lock.write():
+            if self.chain and previous_hash != self.chain[-1].hash():
+                raise StaleBlockError("The chain has moved on from this block's previous hash")
+
+            transactions = []
+            if self.with_transactions:
+                transactions = self.mempool.take(self.block_transactions) + ([reward] if reward else [])
+            # Peers refuse a block that is not after the one before it, even
+            # if this node's clock stepped back
+            timestamp = max(time(), nextafter(self.chain[-1].timestamp, inf)) if self.chain else time()
+            block = self.block_class(index=len(self), timestamp=timestamp,
+                                     proof=proof, previous_hash=previous_hash, transations=transactions, miner=miner,
+                                     difficulty=self.next_difficulty(timestamp))
+
+            self.chain.append(block)
+            if self.with_wallet:
+                self.index_block(block)
+                self.work += self.work_between(block.index, block.index + 1)
+
+        with self.tip_changed:
+            self.tip_changed.notify_all()
+        if self.snapshot_path and block.index and block.index % self.snapshot_every == 0:
+            Thread(target=self.checkpoint, daemon=True).start()
+        return block
+
+    def new_transaction(self, sender: str, receiver: str, amount: float) -> Transaction:
+        """
+        Adds a transaction to the mempool to wait for a block
+
+        :return: <Transaction> The new transaction
+        :raises MempoolError: If the mempool refuses the transaction
+        """
+        transaction = Transaction(sender, receiver, amount)
+        with self.lock.write():
+            self.mempool.add(transaction)
+        return transaction
+
+    def new_transactions(self, transactions: Iterable[dict]) -> List[dict]:
+        """
+        Adds a batch of transactions to the mempool, taking the lock once
+
+        :param transactions: <iterable> Dicts with a sender, receiver and
+        amount. None stands in for an item that could not be parsed
+        :return: <list> For each item, either the transaction that was added
+        or a 'message' saying why it was refused
+        """
+        results = []
+        with self.lock.write():
+            for fields in transactions:
+                try:
+                    transaction = Transaction(fields['sender'], fields['receiver'], fields['amount'])
+                    self.mempool.add(transaction)
+                except (KeyError, TypeError):
+                    results.append({'message': "A transaction needs a sender, receiver and amount"})
+                except MempoolError as error:
+                    results.append({'message': str(error)})
+                else:
+                    results.append(dict(transaction))
+        return results
+
+    def index_block(self, block: Block):
+        """
+        Adds a Block's transactions to the address index so balances are
+        a lookup and histories only touch the address's own transactions
+
+        :param block: <Block> The Block that was just appended to the chain
+        """
+        for position, transaction in enumerate(block.transactions):
+            self.balances[transaction.sender] -= transaction.amount
+            self.balances[transaction.receiver] += transaction.amount
+            self.history[transaction.sender].append((block.index, position))
+            if transaction.receiver != transaction.sender:
+                self.history[transaction.receiver].append((block.index, position))
+
+    def unindex_block(self, block: Block):
+        """
+        Takes a Block's transactions back out of the address index when the
+        block is dropped from the end of the chain
+        """
+        for transaction in block.transactions:
+            self.balances[transaction.sender] += transaction.amount
+            self.balances[transaction.receiver] -= transaction.amount
+            for address in {transaction.sender, transaction.receiver}:
+                history = self.history[address]
+                while history and history[-1][0] >= block.index:
+                    history.pop()
+
+    @PROFILER.section('balance')
+    def balance(self, address: str):
+        with self.lock.read():
+            return self.balances.get(address, 0)
+
+    @PROFILER.section('transactions')
+    def transactions(self, address: str):
+        with self.lock.read():
+            return [self.chain[index].transactions[position] for index, position in self.history.get(address, [])]
+
+    @PROFILER.section('activity')
+    def activity(self, address: str, after: int = -1, after_hash: str = None) -> dict:
+        """
+        What a wallet needs to catch up from a cursor: the address's
+        transactions in blocks after height `after` and its balance, both
+        read under one lock so they agree with each other and the new cursor
+
+        :param after: (Optional) <int> Height of the last block the wallet
+        has seen. -1 for the whole history
+        :param after_hash: (Optional) <str> That block's hash. If the block at
+        `after` no longer has it the chain was replaced, so the whole
+        history is sent and 'reset' is set
+        :return: <dict> 'transactions' (each with the 'index' of its block),
+        'balance', 'reset' and the 'cursor' to send next time
+        """
+        with self.lock.read():
+            reset = after >= len(self.chain) or (
+                after >= 0 and after_hash is not None and self.chain[after].hash() != after_hash)
+            if reset:
+                after = -1
+
+            history = self.history.get(address, [])
+            found = [{'index': index, 'transaction': dict(self.chain[index].transactions[position])}
+                     for index, position in history[bisect_left(history, (after + 1,)):]]
+            return {
+                'transactions': found,
+                'balance': self.balances.get(address, 0),
+                'reset': reset,
+                'cursor': {'height': len(self.chain) - 1, 'hash': self.chain[-1].hash()},
+            }
+
+    def __len__(self):
+        return len(self.chain)
+
+    def register_node(self, address: str):
+        """
+        Adds a peer to sync with
+
+        :param address: <str> The peer's URL, IE 'http://192.168.0.5:5000'
+        """
+        self.nodes.add(address.rstrip('/'))
+
+    def work_between(self, start: int, end: int) -> int:
+        """
+        The proof of work behind the blocks from index `start` up to `end`.
+        Every bit of difficulty doubles it, so a block whose proof met
+        difficulty `d` counts `2 ** d`. The genesis block has no proof.
+        Call with the lock held
+        """
+        return sum(2 ** self.chain[index - 1].difficulty for index in range(max(start, 1), end))
+
+    def resolve_conflicts(self) -> bool:
+        """
+        The most work rule: replaces the end of this chain with the end of
+        any peer's valid chain that has more proof of work behind it
+
+        :return: True if the chain was replaced
+        """
+        # Only nodes that sync with peers need requests
+        import requests
+
+        replaced = False
+        for node in list(self.nodes):
+            try:
+                replaced = self.sync_with(node) or replaced
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, InvalidBlockError,
+                    wire.WireError):
+                continue
+        return replaced
+
+    def sync_with(self, node: str) -> bool:
+        """
+        Downloads and checks only the blocks a peer has after the last block
+        both chains share, and adopts them if they have more work behind
+        them than this chain's blocks after it. A longer chain of easier
+        blocks does not win
+
+        :return: True if the chain was replaced
+        """
+        from . import peers
+
+        status = peers.status(node)
+        length = status['length']
+        # Only a hint: the work is counted again from the blocks themselves
+        if status['work'] <= self.work:
+            return False
+
+        fork = self.find_fork(node, min(length, len(self)))
+        if fork + 1 < self.pruned_height:
+            # Blocks covered by a snapshot are final
+            return False
+        blocks: List[Block] = []
+        work = 0
+        previous = self.block(fork) if fork >= 0 else None
+        now = time()
+        for fields in peers.stream_blocks(node, fork):
+            block = self.check_block(fields, previous, blocks, fork, now)
+            if previous is not None:
+                work += 2 ** previous.difficulty
+            blocks.append(block)
+            previous = block
+        if not blocks:
+            return False
+
+        with self.lock.write():
+            # Only swap if the shared block is still there and we still lose
+            if fork >= 0 and (fork >= len(self.chain) or self.chain[fork].hash() != blocks[0].previous_hash):
+                return False
+            if fork + 1 < self.pruned_height:
+                return False
+            if work <= self.work_between(fork + 1, len(self.chain)):
+                return False
+            self.replace_from(fork + 1, blocks)
+
+        with self.tip_changed:
+            self.tip_changed.notify_all()
+        return True
+
+    def find_fork(self, node: str, shared: int) -> int:
+        """
+        Binary searches for the last of the first `shared` blocks that this
+        chain and the peer's chain have in common
+
+        :return: <int> Its index, or -1 if not even the genesis blocks match
+        """
+        from . import peers
+
+        def same(index: int) -> bool:
+            return peers.block_hashes(node, index)[0] == self.block(index).hash()
+
+        if shared and same(shared - 1):
+            return shared - 1
+
+        low, high = -1, shared - 1
+        while low + 1 < high:
+            middle = (low + high) // 2
+            if same(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def check_block(self, fields: dict, previous: Block, blocks: List[Block], fork: int, now: float) -> Block:
+        """
+        Rebuilds a peer's block and checks that it follows from `previous`:
+        its index and link, its Merkle root, its transactions, its
+        timestamp, its difficulty and its proof. Every transaction must pass
+        the mempool's checks, and the only one from a `node ` address may be
+        the block's own reward of REWARD. A genesis block must start at this
+        chain's difficulty
+
+        :param blocks: <list> The peer's blocks already checked, which follow
+        on from this chain's block at index `fork`
+        :param now: <float> The time on this node's clock
+        :raises InvalidBlockError: If the block is not valid
+        """
+        block = Block(fields['index'], fields['timestamp'], fields['proof'], fields['previous_hash'],
+                      [Transaction(**transaction) for transaction in fields['transations']], fields['miner'],
+                      fields['difficulty'])
+        if block.merkle_root != fields['merkle_root']:
+            raise InvalidBlockError(f"Block {block.index} does not match its Merkle root")
+        leaves = block.leaves()
+        if len(set(leaves)) != len(leaves):
+            # [a, b, c, c] has the same root as [a, b, c], see merkle.py
+            raise InvalidBlockError(f"Block {block.index} repeats a transaction")
+        rewards = 0
+        for transaction in block.transactions:
+            try:
+                check(transaction)
+            except MempoolError as error:
+                raise InvalidBlockError(f"Block {block.index} has an invalid transaction: {error}")
+            if transaction.sender.startswith('node '):
+                rewards += 1
+                if transaction.sender != f"node {block.index}" or transaction.amount != REWARD or rewards > 1:
+                    raise InvalidBlockError(f"Block {block.index} has an invalid reward")
+        if block.timestamp > now + MAX_FUTURE_SECONDS:
+            raise InvalidBlockError(f"Block {block.index} is too far in the future")
+        if previous is None:
+            # A peer with a different genesis block replaces the whole chain,
+            # but only if it is as hard to extend as a new chain here
+            if block.index != 0:
+                raise InvalidBlockError("The peer's chain does not start with a genesis block")
+            if block.difficulty != self.difficulty:
+                raise InvalidBlockError("The peer's genesis block has the wrong difficulty")
+            return block
+
+        if block.index != previous.index + 1 or block.previous_hash != previous.hash():
+            raise InvalidBlockError(f"Block {block.index} does not follow block {previous.index}")
+        if block.timestamp <= previous.timestamp:
+            raise InvalidBlockError(f"Block {block.index} is not after block {previous.index}")
+
+        expected = previous.difficulty
+        if block.index % RETARGET_INTERVAL == 0:
+            start = block.index - RETARGET_INTERVAL
+            first = self.block(start) if start <= fork else blocks[start - fork - 1]
+            expected = retarget(previous.difficulty, block.timestamp - first.timestamp)
+        if block.difficulty != expected:
+            raise InvalidBlockError(f"Block {block.index} has the wrong difficulty")
+
+        if not self.valid_proof(str(previous), block.proof, previous.difficulty):
+            raise InvalidBlockError(f"Block {block.index} has an invalid proof")
+        return block
+
+    def replace_from(self, index: int, blocks: List[Block]):
+        """
+        Swaps every block from `index` on for `blocks`. Transactions only
+        in the dropped blocks go back to the mempool if they still fit, and
+        ones the new blocks include leave it. Call with the write lock held.
+        """
+        dropped = [self.chain[position] for position in range(index, len(self.chain))]
+        self.work -= self.work_between(index, len(self.chain))
+        for block in reversed(dropped):
+            self.unindex_block(block)
+        if isinstance(self.chain, list):
+            del self.chain[index:]
+        else:
+            self.chain.truncate(index)
+
+        for block in blocks:
+            self.chain.append(block)
+            self.index_block(block)
+            for transaction in block.transactions:
+                self.mempool.discard(transaction.hash())
+        self.work += self.work_between(index, len(self.chain))
+
+        for block in dropped:
+            for transaction in block.transactions:
+                try:
+                    self.mempool.add(transaction)
+                except MempoolError:
+                    pass
+
+    def snapshot(self) -> dict:
+        """
+        The state derived from the chain: every non-zero balance, and the
+        header of every block so the chain can still be linked, checked and
+        extended without the blocks' transactions
+
+        :return: <dict> The snapshot, covering the first `height` blocks
+        """
+        with self.lock.read():
+            return {
+                'height': len(self.chain),
+                'tip': self.chain[-1].hash() if self.chain else None,
+                'balances': {address: balance for address, balance in self.balances.items() if balance},
+                'headers': [dict(self.chain[index].header()) for index in range(len(self.chain))],
+            }
+
+    @staticmethod
+    def save_snapshot(snapshot_path: str, snapshot: dict):
+        """
+        Writes a snapshot next to its destination first, so a crash never
+        leaves a half written snapshot behind
+        """
+        with open(f'{snapshot_path}.tmp', 'w') as f:
+            f.write(dumps(snapshot))
+        replace(f'{snapshot_path}.tmp', snapshot_path)
+
+    @staticmethod
+    def load_snapshot(snapshot_path: str) -> dict:
+        """
+        Reads a snapshot and checks that its headers link up to its tip.
+        Proofs are not checked again: a snapshot is trusted like the node's
+        own storage
+
+        :raises InvalidBlockError: If the headers do not form a chain
+        """
+        with open(snapshot_path) as f:
+            snapshot = loads(f.read())
+
+        blocks = [Block.from_header(fields) for fields in snapshot['headers']]
+        for previous, block in zip(blocks, blocks[1:]):
+            if block.index != previous.index + 1 or block.previous_hash != previous.hash():
+                raise InvalidBlockError(f"Snapshot block {block.index} does not follow block {previous.index}")
+        if len(blocks) != snapshot['height'] or (blocks and blocks[-1].hash() != snapshot['tip']):
+            raise InvalidBlockError("The snapshot's headers do not end at its tip")
+        snapshot['blocks'] = blocks
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        """
+        Starts from a snapshot instead of replaying the blocks it covers. An
+        empty chain is filled in with the snapshot's headers. A chain that
+        holds the snapshot's tip keeps its blocks. When pruning, none of the
+        blocks the snapshot covers are replayed, since their history would
+        be dropped anyway. Otherwise only the ones that really are headers
+        are left out of the address index, and the rest are replayed with
+        the blocks after the tip. A chain that does not hold the tip is
+        replayed in full.
+
+        :return: <int> How many blocks the snapshot's work was counted for,
+        so a chain on disk does not decode them again to count it
+        """
+        height = snapshot['height']
+        if not height:
+            return 0
+        if not self.chain:
+            for block in snapshot['blocks']:
+                self.chain.append(block)
+        elif len(self.chain) < height or self.chain[height - 1].hash() != snapshot['tip']:
+            return 0
+        blocks = snapshot['blocks']
+        self.work = sum(2 ** blocks[index - 1].difficulty for index in range(1, height))
+
+        # Blocks are pruned from the start of the chain, so the last header
+        # only block is where replaying has to start. A chain on disk keeps
+        # its transactions there even when pruning
+        pruned = height
+        while not self.pruning and pruned and not self.chain[pruned - 1].pruned:
+            pruned -= 1
+        if not pruned:
+            return height
+
+        # The snapshot's balances cover every block up to its tip. Take the
+        # blocks that are replayed back out so they are not counted twice
+        self.balances.update(snapshot['balances'])
+        for index in range(pruned, height):
+            for sender, receiver, amount in self.chain[index].transactions.rows():
+                self.balances[sender] += amount
+                self.balances[receiver] -= amount
+        self.pruned_height = pruned
+        return height
+
+    def checkpoint(self):
+        """
+        Saves a snapshot and, when pruning, drops the transactions it
+        covers. Runs on its own thread; one at a time
+        """
+        if not self.checkpointing.acquire(blocking=False):
+            return
+        try:
+            snapshot = self.snapshot()
+            self.save_snapshot(self.snapshot_path, snapshot)
+            if self.pruning:
+                self.prune(snapshot['height'], snapshot['tip'])
+        finally:
+            self.checkpointing.release()
+
+    def prune(self, height: int, tip: str):
+        """
+        Replaces the first `height` blocks with their headers and forgets
+        their place in the address history. Balances are kept, so only
+        `transactions` stops seeing them. A chain on disk keeps its blocks
+        there, which are not in memory anyway.
+
+        :param tip: <str> The hash of block `height - 1`. Nothing is pruned
+        if the chain no longer has it
+        """
+        with self.lock.write():
+            if height <= self.pruned_height or len(self.chain) < height or self.chain[height - 1].hash() != tip:
+                return
+            if isinstance(self.chain, list):
+                for index in range(self.pruned_height, height):
+                    self.chain[index] = self.chain[index].prune()
+            for address in list(self.history):
+                history = self.history[address]
+                kept = [entry for entry in history if entry[0] >= height]
+                if len(kept) != len(history):
+                    if kept:
+                        self.history[address] = kept
+                    else:
+                        del self.history[address]
+            self.pruned_height = height
+
+    def next_difficulty(self, timestamp: float) -> int:
+        """
+        The difficulty a block added now, at `timestamp`, sets for the proof
+        of the block after it. It only changes every RETARGET_INTERVAL blocks.
+        """
+        if not self.chain:
+            return self.difficulty
+
+        difficulty = self.chain[-1].difficulty
+        index = len(self.chain)
+        if index % RETARGET_INTERVAL:
+            return difficulty
+        return retarget(difficulty, timestamp - self.chain[index - RETARGET_INTERVAL].timestamp)
+
+    @property
+    def last_block(self):
+        with self.lock.read():
+            return self.chain[-1]
+
+    def block(self, index: int) -> Block:
+        with self.lock.read():
+            return self.chain[index]
+
+    def screen_submission(self, proof, previous_hash: str = None, tip: Block = None) -> Optional[str]:
+        """
+        Turns away a proof sent to `/mine` before any hashing is done
+
+        :param previous_hash: (Optional) <str> Hash of the block the miner
+        extended. Older miners do not send it
+        :param tip: (Optional) <Block> The last block, if the caller has it
+        :return: <str> 'stale' if the proof extends a block that is no longer
+        the last one, 'invalid' if it was already sent for the last block and
+        found invalid, 'duplicate' if it was already sent and is being
+        checked or was accepted, or None if it needs checking. Report what
+        came of checking it with `record_submission`
+        """
+        tip_hash = (tip or self.last_block).hash()
+        if previous_hash is not None and previous_hash != tip_hash:
+            return 'stale'
+
+        key = str(proof)
+        with self.submitted_lock:
+            if self.submitted_tip != tip_hash:
+                self.submitted_tip = tip_hash
+                self.submitted = {}
+            outcome = self.submitted.get(key)
+            if outcome is not None:
+                return 'invalid' if outcome == 'invalid' else 'duplicate'
+            if len(self.submitted) < MAX_SUBMISSIONS:
+                self.submitted[key] = 'pending'
+        return None
+
+    def record_submission(self, proof, tip: Block, outcome: Optional[str]):
+        """
+        Remembers what came of checking a proof `screen_submission` let
+        through, so the same proof sent again gets the same answer
+
+        :param tip: <Block> The last block the proof was checked against
+        :param outcome: <str> 'invalid' or 'accepted', or None to forget the
+        proof when its block could not be added, so it can be sent again
+        """
+        key = str(proof)
+        with self.submitted_lock:
+            if self.submitted_tip != tip.hash() or key not in self.submitted:
+                return
+            if outcome is None:
+                del self.submitted[key]
+            else:
+                self.submitted[key] = outcome
+
+    def wait_for_tip(self, known_hash: str, timeout: float):
+        """
+        Blocks until the last block's hash is no longer `known_hash` or
+        `timeout` seconds pass
+
+        :return: <Block> The last block
+        """
+        with self.tip_changed:
+            self.tip_changed.wait_for(lambda: self.last_block.hash() != known_hash, timeout)
+            return self.last_block
+
+    def inclusion_proof(self, index: int, transaction_hash: str):
+        """
+        Proves that a transaction is in the block at `index` without the
+        rest of the block's transactions
+
+        :return: <dict> The block header, the transaction, its position and
+        its Merkle proof, or None if the block does not hold the transaction.
+        The header of the block before it comes along so the block's proof
+        of work can be checked too
+        """
+        with self.lock.read():
+            block = self.chain[index]
+            previous = self.chain[index - 1] if index > 0 else None
+
+        leaves = block.leaves()
+        try:
+            position = leaves.index(bytes.fromhex(transaction_hash))
+        except ValueError:
+            return None
+
+        return {
+            'header': dict(block.header()),
+            'previous_header': dict(previous.header()) if previous is not None else None,
+            'position': position,
+            'proof': merkle.merkle_proof(leaves, position),
+            'transaction': dict(block.transactions[position]),
+        }
+
+    def chain_range(self, start: int, limit: int = None) -> Tuple[str, int, Optional[str]]:
+        """
+        Fixes what a `/chain` response covers, all under one read lock
+
+        :param limit: (Optional) <int> Most blocks to send, all by default
+        :return: <tuple> The tip's hash, the index just past the last block
+        to send, and the hash of the block before `start` for
+        `linked_blocks` to check the first block against
+        """
+        with self.lock.read():
+            length = len(self.chain)
+            end = length if limit is None else min(length, start + max(limit, 0))
+            previous_hash = self.chain[start - 1].hash() if 0 < start <= length else None
+            return self.chain[-1].hash(), end, previous_hash
+
+    def linked_blocks(self, start: int, end: int, previous_hash: str = None) -> Iterator[Block]:
+        """
+        Yields the blocks from `start` up to `end` one at a time, as long as
+        each still follows the one before it. A response streamed from it
+        ends early rather than mixing two forks when a peer's chain replaces
+        this one part way through, or the chain gets shorter
+
+        :param previous_hash: (Optional) <str> The hash the first block must
+        follow, from `chain_range`
+        """
+        for index in range(start, end):
+            with self.lock.read():
+                if index >= len(self.chain):
+                    return
+                block = self.chain[index]
+            if previous_hash is not None and block.previous_hash != previous_hash:
+                return
+            previous_hash = block.hash()
+            yield block
+
+    @staticmethod
+    @PROFILER.section('valid_proof')
+    def valid_proof(block_string: str, proof: int, difficulty: int = DIFFICULTY):
+        """
+        Validates the Proof:  Does hash(block_string, proof) start with
+        `difficulty` zero bits?  Return true if the proof is valid
+
+        :param block_string: <string> The stringified block to use to
+        check in combination with `proof`
+
+        :param proof: <int?> The value that when combined with the
+        stringified previous block results in a hash that has the
+        correct number of leading zero bits.
+
+        :param difficulty: <int> The leading zero bits the previous block
+        asks for
+
+        :return: True if the resulting hash is a valid proof, False otherwise
+        """
+        with VALID_PROOF_SECONDS.time():
+            return ProofHasher(block_string, difficulty).valid(proof)
+
+    @staticmethod
+    @PROFILER.section('proof_of_work')
+    def proof_of_work(block):
+        """
+        Simple Proof of Work Algorithm
+        Stringify the block and look for a proof.
+        Loop through possibilities, checking each one against `valid_proof`
+        in an effort to find a number that is a valid proof
+
+        :return: A valid proof for the provided block
+        """
+
+        hasher = ProofHasher(str(block), block.difficulty)
+        proof = 0
+        while not hasher.valid(proof):
+            proof += 1
+
+        return proof
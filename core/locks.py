@@ -0,0 +1,46 @@
+"""
+Locking for `Blockchain` so a node can serve requests from many threads.
+"""
+from contextlib import contextmanager
+from threading import Condition
+
+
+class ReadWriteLock():
+    """
+    Lets any number of readers hold the lock at once while a writer holds
+    it alone. Waiting writers hold off new readers so a steady stream of
+    reads can not starve them. Neither side is reentrant.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.writing and not self.writers_waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.writers_waiting += 1
+            self.condition.wait_for(lambda: not self.writing and not self.readers)
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
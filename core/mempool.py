@@ -0,0 +1,116 @@
+"""
+The pool of transactions waiting to be put into a block.
+"""
+from collections import OrderedDict, defaultdict
+from math import isfinite
+from typing import Callable, Dict, List
+
+
+class MempoolError(Exception):
+    """
+    Raised when a transaction is not admitted to the mempool
+    """
+
+
+def check(transaction):
+    """
+    Refuses a transaction a block could not store or hash: addresses that
+    are not strings, or an amount that is not a positive, finite number a
+    double holds exactly. NaN compares false with everything, so it would
+    pass the overdraft check
+
+    :raises MempoolError: If the transaction is malformed
+    """
+    if not isinstance(transaction.sender, str) or not isinstance(transaction.receiver, str):
+        raise MempoolError("Sender and receiver must be strings")
+
+    amount = transaction.amount
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        raise MempoolError("Amount must be a positive number")
+    try:
+        exact = float(amount) == amount
+    except OverflowError:
+        exact = False
+    if not exact or not isfinite(amount):
+        raise MempoolError("Amount must be a finite number that fits in a double")
+    if amount <= 0:
+        raise MempoolError("Amount must be a positive number")
+
+
+class Mempool():
+    """
+    Pending transactions in the order they arrived, keyed by their hash so a
+    resubmitted transaction is only kept once.
+
+    Holds at most `capacity` transactions, dropping the oldest to make room.
+    When given a `balance` lookup it also tracks how much every sender has
+    pending, so a transfer that would overdraw its sender is refused without
+    looking through the pool.
+    """
+
+    def __init__(self, capacity: int, balance: Callable[[str], float] = None):
+        """
+        :param capacity: <int> Most transactions the pool holds at once
+        :param balance: (Optional) <callable> Looks up an address's confirmed
+        balance. Overdrafts are not checked without it
+        """
+        self.capacity = capacity
+        self.balance = balance
+        self.transactions: Dict[str, object] = OrderedDict()
+        self.pending: Dict[str, float] = defaultdict(int)
+
+    def add(self, transaction) -> str:
+        """
+        Admits a transaction. It is checked in full before the pool changes,
+        so a refused transaction leaves nothing behind
+
+        :return: <str> The transaction's hash
+        """
+        check(transaction)
+
+        key = transaction.hash()
+        if key in self.transactions:
+            raise MempoolError("Transaction is already pending")
+
+        if self.balance is not None:
+            # get() so refused senders do not leave zero entries behind
+            available = self.balance(transaction.sender) - self.pending.get(transaction.sender, 0)
+            if transaction.amount > available:
+                raise MempoolError("Insufficient funds")
+
+        while len(self.transactions) >= self.capacity:
+            self.release(self.transactions.popitem(last=False)[1])
+
+        self.pending[transaction.sender] += transaction.amount
+        self.transactions[key] = transaction
+        return key
+
+    def take(self, limit: int) -> List:
+        """
+        Removes and returns up to `limit` of the oldest transactions
+        """
+        taken = []
+        while self.transactions and len(taken) < limit:
+            transaction = self.transactions.popitem(last=False)[1]
+            self.release(transaction)
+            taken.append(transaction)
+        return taken
+
+    def discard(self, key: str):
+        """
+        Drops the transaction with hash `key` if it is pending
+        """
+        transaction = self.transactions.pop(key, None)
+        if transaction is not None:
+            self.release(transaction)
+
+    def release(self, transaction):
+        self.pending[transaction.sender] -= transaction.amount
+        if not self.pending[transaction.sender]:
+            del self.pending[transaction.sender]
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(self.transactions.values())
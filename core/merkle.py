@@ -0,0 +1,73 @@
+"""
+Merkle trees over a block's transactions.
+
+Leaves are the SHA-256 of each transaction's serialization and every parent
+is the SHA-256 of its two children's digests. A level with an odd number of
+nodes pairs its last node with itself. A block stores only the root, so one
+transaction's inclusion can be shown with one sibling hash per level.
+
+Pairing a node with itself means `[a, b, c]` and `[a, b, c, c]` have the same
+root. Blocks never hold the same transaction twice, so a block from a peer
+that does is refused rather than trusted by its root.
+"""
+from hashlib import sha256
+from typing import List, Tuple
+
+EMPTY_ROOT = sha256(b'').hexdigest()
+
+
+def leaf(data: bytes) -> bytes:
+    return sha256(data).digest()
+
+
+def parent(left: bytes, right: bytes) -> bytes:
+    return sha256(left + right).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> str:
+    """
+    :param leaves: <list> The leaf digests, in transaction order
+    :return: <str> The hex digest of the root
+    """
+    if not leaves:
+        return EMPTY_ROOT
+
+    level = leaves
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + level[-1:]
+        level = [parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def merkle_proof(leaves: List[bytes], position: int) -> List[Tuple[str, str]]:
+    """
+    :param leaves: <list> The leaf digests, in transaction order
+    :param position: <int> Which leaf to prove
+    :return: <list> `(side, hex digest)` for the sibling at every level,
+    from the leaves up, where side says which side the sibling is on
+    """
+    proof = []
+    level = leaves
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + level[-1:]
+        sibling = position ^ 1
+        proof.append(('left' if sibling < position else 'right', level[sibling].hex()))
+        level = [parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        position //= 2
+    return proof
+
+
+def verify_proof(data: bytes, proof: List[Tuple[str, str]], root: str) -> bool:
+    """
+    :param data: <bytes> The serialized transaction
+    :param proof: <list> The proof from `merkle_proof`
+    :param root: <str> The Merkle root the block header commits to
+    :return: True if the transaction is included under `root`
+    """
+    node = leaf(data)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = parent(sibling, node) if side == 'left' else parent(node, sibling)
+    return node.hex() == root
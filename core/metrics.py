@@ -0,0 +1,261 @@
+"""
+Counters, gauges and histograms exported in the Prometheus text format.
+
+Metrics register themselves with `REGISTRY` when created and
+`REGISTRY.render()` writes every one of them out, which is what a node's
+`/metrics` endpoint serves. Nothing here imports Flask, so miners can keep
+the same counters without it.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, for request handling
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# Bytes, from 1KB to 64MB
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry():
+    def __init__(self):
+        self.metrics: List = []
+        self.lock = Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if any(existing.name == metric.name for existing in self.metrics):
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self.metrics.append(metric)
+        return metric
+
+    def get(self, name: str):
+        """
+        :return: The metric registered as `name`, or None
+        """
+        for metric in self.metrics:
+            if metric.name == name:
+                return metric
+        return None
+
+    def render(self) -> str:
+        """
+        :return: <str> Every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric():
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        """
+        :param name: <str> The metric's name, IE `mine_submissions_total`
+        :param help: <str> What it measures
+        :param labels: (Optional) <tuple> Names of the labels every sample has
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def key(self, labels: Dict[str, str]) -> Tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labels)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple, float] = {}
+        if not self.labels:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Given a `function` the gauge is read
+    from it whenever the metrics are rendered instead of being set.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Callable[[], float] = None, registry: Registry = REGISTRY):
+        super().__init__(name, help, (), registry)
+        self.function = function
+        self.current = 0
+
+    def set(self, value: float):
+        self.current = value
+
+    def value(self) -> float:
+        return self.function() if self.function is not None else self.current
+
+    def samples(self):
+        yield f'{self.name} {format_value(self.value())}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS,
+                 registry: Registry = REGISTRY):
+        """
+        :param buckets: (Optional) <tuple> Upper bounds of the buckets, in
+        increasing order. A `+Inf` bucket is always added
+        """
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets)
+        # Per label set: [count in each bucket and +Inf, sum of observations]
+        self.values: Dict[Tuple, List] = {}
+        if not self.labels:
+            self.values[()] = [[0] * (len(self.buckets) + 1), 0]
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[position] += 1
+            self.values[key] = [counts, total + value]
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes how many seconds the body of a `with` block takes
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        counts, _ = self.values.get(self.key(labels)) or ([], 0)
+        return sum(counts)
+
+    def sum(self, **labels) -> float:
+        return (self.values.get(self.key(labels)) or (None, 0))[1]
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(names, key + (format_value(bound),))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labels, key)} {cumulative}'
+
+
+def request_histogram(registry: Registry = REGISTRY) -> Histogram:
+    """
+    The request latency histogram in `registry`, created on first use so
+    every server in a process records into the same one
+    """
+    latency = registry.get('http_request_duration_seconds')
+    if latency is None:
+        latency = Histogram('http_request_duration_seconds', 'Time spent handling a request, by route',
+                            ('method', 'route', 'status'), registry=registry)
+    return latency
+
+
+def instrument(app, registry: Registry = REGISTRY):
+    """
+    Times every request `app` handles by method, route and status and adds
+    a `/metrics` endpoint that serves `registry`
+    """
+    from flask import Response, g, request
+
+    latency = request_histogram(registry)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            latency.observe(perf_counter() - start, method=request.method, route=route,
+                            status=str(response.status_code))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    return app
+
+
+def serve(port: int, registry: Registry = REGISTRY):
+    """
+    Serves `registry` on `http://0.0.0.0:<port>/metrics` from a background
+    thread, for processes that are not already web servers
+
+    :return: <ThreadingHTTPServer> The server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
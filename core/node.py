@@ -0,0 +1,289 @@
+"""
+The Flask app in front of a `Blockchain`. This is the only part of the core
+that imports Flask, so miners and validators that only need the chain never
+load it.
+
+Which routes an app has follows from its chain and `client_mining`:
+
+* every node serves `/mine`, `/chain`, `/metrics` and `/admin/profile`
+* with client mining, miners POST proofs to `/mine` and follow the tip with
+  `/last_block` and `/last_block/wait`. Without it `GET /mine` searches for
+  a proof on the node itself
+* a chain with transactions adds `/new_transaction`, `/new_transactions` and
+  the Merkle proofs at `/block/<index>/proof/<transaction_hash>`
+* a wallet adds `/<miner>/transactions`, `/<miner>/balance`, `/<miner>/sync`
+  and what peers sync through: `/status`, `/hashes` and `/nodes/*`
+"""
+from uuid import uuid4
+
+from flask import Flask, Response, jsonify, request
+
+from . import wire
+
+from .api import (CHAIN_RESPONSE_BYTES, MINE_REJECTIONS, MINE_SUBMISSIONS, PROOF_OF_WORK_SECONDS, gauges, parse_line,
+                  rejection)
+from .chain import REWARD, Block, Blockchain, StaleBlockError, Transaction
+from .mempool import MempoolError
+from .metrics import instrument
+from .profiling import install
+
+node_identifier = str(uuid4()).replace('-', '')
+
+
+def create_app(blockchain: Blockchain, client_mining: bool = True, name: str = __name__) -> Flask:
+    """
+    :param blockchain: <Blockchain> The chain to serve. Handlers read it from
+    `app.blockchain`, so it can be swapped for another one later
+    :param client_mining: (Optional) <bool> Take proofs from miners instead
+    of mining on the node
+    :param name: (Optional) <str> The Flask app's import name
+    :return: <Flask> The app
+    """
+    app = Flask(name)
+    app.blockchain = blockchain
+    instrument(app)
+    install(app)
+    gauges(lambda: app.blockchain)
+
+    def block_response(block: Block, header_only: bool = False):
+        """
+        Sends a block as JSON, or in the binary wire encoding when the client's
+        Accept header prefers it
+        """
+        if wire.prefers_binary(request.headers.get('Accept', '')):
+            return Response(block.encode_binary(header_only), mimetype=wire.MIMETYPE)
+        return Response(block.encode_header() if header_only else block.encode(), mimetype='application/json')
+
+    def rejected(message: str, tip: Block):
+        return jsonify(rejection(message, tip)), 409
+
+    if client_mining:
+        @app.route('/mine', methods=['POST'])
+        def mine():
+            blockchain = app.blockchain
+            proof = request.json['proof']
+            miner = request.json['miner']
+            last_block = blockchain.last_block
+            # Miners name the block they extended, so a proof for an old tip or one
+            # that was already sent is refused without hashing it
+            screened = blockchain.screen_submission(proof, request.json.get('previous_hash'), last_block)
+            if screened == 'invalid':
+                MINE_SUBMISSIONS.inc(result='invalid')
+                return jsonify("Invalid Proof"), 400
+            if screened is not None:
+                MINE_REJECTIONS.inc(reason=screened)
+                return rejected(f"{screened.capitalize()} Proof", last_block)
+
+            valid = Blockchain.valid_proof(str(last_block), proof, last_block.difficulty)
+
+            if not valid:
+                blockchain.record_submission(proof, last_block, 'invalid')
+                MINE_SUBMISSIONS.inc(result='invalid')
+                return jsonify("Invalid Proof"), 400
+
+            reward = None
+            if blockchain.with_transactions:
+                reward = Transaction(f"node {last_block.index + 1}", miner, REWARD)
+            try:
+                block = blockchain.new_block(proof, last_block.hash(), miner, reward)
+            except StaleBlockError:
+                blockchain.record_submission(proof, last_block, None)
+                MINE_SUBMISSIONS.inc(result='stale')
+                return rejected("Stale Proof", blockchain.last_block)
+            except Exception:
+                blockchain.record_submission(proof, last_block, None)
+                raise
+            blockchain.record_submission(proof, last_block, 'accepted')
+            MINE_SUBMISSIONS.inc(result='accepted')
+            return block_response(block), 200
+
+        @app.route('/last_block', methods=['GET'])
+        def last_block():
+            return block_response(app.blockchain.last_block, header_only=True), 200
+
+        @app.route('/last_block/wait', methods=['GET'])
+        def wait_for_block():
+            """
+            Long-polls for a new tip so miners can drop stale work. Responds with
+            the last block as soon as its hash differs from `?hash=`, or after
+            `?timeout=` seconds (30 by default, 60 at most)
+            """
+            timeout = min(request.args.get('timeout', 30, type=float), 60)
+            block = app.blockchain.wait_for_tip(request.args.get('hash'), timeout)
+            return block_response(block, header_only=True), 200
+    else:
+        @app.route('/mine', methods=['GET'])
+        def mine():
+            blockchain = app.blockchain
+            last_block = blockchain.last_block
+            with PROOF_OF_WORK_SECONDS.time():
+                proof = Blockchain.proof_of_work(last_block)
+            reward = None
+            if blockchain.with_transactions:
+                reward = Transaction(f"node {last_block.index + 1}", node_identifier, REWARD)
+            try:
+                block = blockchain.new_block(proof, last_block.hash(), node_identifier, reward)
+            except StaleBlockError:
+                MINE_SUBMISSIONS.inc(result='stale')
+                return jsonify("Stale Proof"), 409
+            MINE_SUBMISSIONS.inc(result='accepted')
+            return block_response(block), 200
+
+    @app.route('/chain', methods=['GET'])
+    def full_chain():
+        """
+        Streams the chain as a JSON list, one block at a time, or as length
+        prefixed blocks in the binary wire encoding if the client prefers it
+
+        * `?start=<index>&limit=<count>` returns `count` blocks from `index`
+        * `?since=<index>` returns every block after `index`
+
+        The tip hash is used as the ETag so an unchanged chain is a 304. The
+        tip and range are fixed together, and the stream ends early if the
+        chain is replaced while it is sent
+        """
+        blockchain = app.blockchain
+        if 'since' in request.args:
+            start = request.args.get('since', -1, type=int) + 1
+        else:
+            start = request.args.get('start', 0, type=int)
+        start = max(start, 0)
+        tip, end, previous_hash = blockchain.chain_range(start, request.args.get('limit', type=int))
+        if tip in request.if_none_match:
+            return Response(status=304)
+
+        def generate_binary():
+            size = 0
+            for block in blockchain.linked_blocks(start, end, previous_hash):
+                data = wire.record(block.encode_binary())
+                size += len(data)
+                yield data
+            CHAIN_RESPONSE_BYTES.observe(size)
+
+        def generate():
+            size = 2
+            yield b'['
+            for position, block in enumerate(blockchain.linked_blocks(start, end, previous_hash)):
+                if position:
+                    size += 2
+                    yield b', '
+                data = block.encode()
+                size += len(data)
+                yield data
+            yield b']'
+            CHAIN_RESPONSE_BYTES.observe(size)
+
+        if wire.prefers_binary(request.headers.get('Accept', '')):
+            response = Response(generate_binary(), mimetype=wire.MIMETYPE)
+        else:
+            response = Response(generate(), mimetype='application/json')
+        response.set_etag(tip)
+        return response, 200
+
+    if blockchain.with_transactions:
+        @app.route('/new_transaction', methods=['POST'])
+        def new_transation():
+            sender = request.json['sender']
+            receiver = request.json['receiver']
+            amount = request.json['amount']
+            try:
+                transaction = app.blockchain.new_transaction(sender, receiver, amount)
+            except MempoolError as error:
+                return jsonify({'message': str(error)}), 400
+            return jsonify(dict(transaction)), 200
+
+        @app.route('/new_transactions', methods=['POST'])
+        def new_transactions():
+            """
+            Submits many transactions at once, either as a JSON array, as
+            newline-delimited JSON (`Content-Type: application/x-ndjson`) or in the
+            binary wire encoding (`Content-Type: application/octet-stream`).
+            Answers with one result per transaction, in order
+            """
+            if request.mimetype == 'application/x-ndjson':
+                transactions = [parse_line(line) for line in request.stream if line.strip()]
+            elif request.mimetype == wire.MIMETYPE:
+                try:
+                    transactions = wire.decode_transactions(request.get_data())
+                except wire.WireError as error:
+                    return jsonify({'message': str(error)}), 400
+            else:
+                transactions = request.get_json(silent=True)
+                if not isinstance(transactions, list):
+                    return jsonify({'message': "Expected a JSON array of transactions"}), 400
+
+            return jsonify(app.blockchain.new_transactions(transactions)), 200
+
+        @app.route('/block/<int:index>/proof/<transaction_hash>', methods=['GET'])
+        def inclusion_proof(index, transaction_hash):
+            """
+            A Merkle proof that the transaction with the given hash is in the block
+            at `index`, for wallets that only keep block headers
+            """
+            blockchain = app.blockchain
+            if not 0 <= index < len(blockchain):
+                return jsonify({'message': "No such block"}), 404
+
+            if blockchain.block(index).pruned:
+                return jsonify({'message': "The block's transactions have been pruned"}), 404
+
+            proof = blockchain.inclusion_proof(index, transaction_hash)
+            if proof is None:
+                return jsonify({'message': "The block does not hold that transaction"}), 404
+            return jsonify(proof), 200
+
+    if blockchain.with_wallet:
+        @app.route('/<miner>/transactions', methods=['GET'])
+        def transactions(miner):
+            transactions = [dict(transaction) for transaction in app.blockchain.transactions(miner)]
+            return jsonify(transactions), 200
+
+        @app.route('/<miner>/balance', methods=['GET'])
+        def balance(miner):
+            return jsonify(app.blockchain.balance(miner)), 200
+
+        @app.route('/<miner>/sync', methods=['GET'])
+        def sync(miner):
+            """
+            The address's transactions after `?after=` (a block height) and its
+            balance in one response, so a wallet with a cached history only
+            downloads what is new. `?hash=` is the hash of the block at `after`,
+            to notice when the chain was replaced
+            """
+            after = request.args.get('after', -1, type=int)
+            return jsonify(app.blockchain.activity(miner, max(after, -1), request.args.get('hash'))), 200
+
+        @app.route('/status', methods=['GET'])
+        def status():
+            blockchain = app.blockchain
+            tip = blockchain.last_block.hash()
+            return jsonify({'length': len(blockchain), 'tip': tip, 'work': blockchain.work}), 200
+
+        @app.route('/hashes', methods=['GET'])
+        def block_hashes():
+            """
+            The hashes of `?limit=` blocks from index `?start=`, which peers use to
+            find where their chains fork without downloading blocks
+            """
+            blockchain = app.blockchain
+            start = max(request.args.get('start', 0, type=int), 0)
+            end = min(len(blockchain), start + max(request.args.get('limit', 1, type=int), 0))
+            return jsonify([blockchain.block(index).hash() for index in range(start, end)]), 200
+
+        @app.route('/nodes/register', methods=['POST'])
+        def register_nodes():
+            nodes = (request.get_json(silent=True) or {}).get('nodes')
+            if not isinstance(nodes, list):
+                return jsonify({'message': "Expected a list of 'nodes'"}), 400
+
+            for node in nodes:
+                app.blockchain.register_node(node)
+            return jsonify({'nodes': sorted(app.blockchain.nodes)}), 200
+
+        @app.route('/nodes/resolve', methods=['GET'])
+        def consensus():
+            blockchain = app.blockchain
+            replaced = blockchain.resolve_conflicts()
+            return jsonify({'replaced': replaced, 'length': len(blockchain), 'tip': blockchain.last_block.hash()}), 200
+
+    return app
@@ -0,0 +1,66 @@
+"""
+The requests a node makes to its peers while syncing.
+"""
+import requests
+
+from codecs import getincrementaldecoder
+from json import JSONDecoder
+from typing import Iterator, List
+
+from . import wire
+
+# Seconds to wait on a peer before giving up on it
+TIMEOUT = 10
+
+session = requests.Session()
+
+
+def status(node: str) -> dict:
+    """
+    :return: <dict> The peer's chain `length`, `tip` hash and the proof of
+    `work` behind it
+    """
+    response = session.get(url=f"{node}/status", timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def block_hashes(node: str, start: int, limit: int = 1) -> List[str]:
+    response = session.get(url=f"{node}/hashes", params={'start': start, 'limit': limit}, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def stream_blocks(node: str, since: int) -> Iterator[dict]:
+    """
+    Yields the peer's blocks after index `since` one at a time, as they
+    come off the wire, instead of waiting for the whole /chain response.
+    Asks for the binary wire encoding and falls back to JSON for peers
+    that only speak JSON
+    """
+    decoder = JSONDecoder()
+    text = getincrementaldecoder('utf-8')()
+    buffer = ''
+
+    with session.get(url=f"{node}/chain", params={'since': since}, headers={'Accept': wire.MIMETYPE}, stream=True,
+                     timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith(wire.MIMETYPE):
+            for record in wire.read_records(response.iter_content(chunk_size=1 << 16)):
+                yield wire.decode_block(record)
+            return
+
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            buffer += text.decode(chunk)
+            while True:
+                # Skip the list's brackets and separators between blocks
+                buffer = buffer.lstrip('[], \r\n\t')
+                try:
+                    block, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                yield block
+
+    if buffer.lstrip('[], \r\n\t'):
+        raise ValueError("Peer sent an incomplete chain")
@@ -0,0 +1,257 @@
+"""
+Opt-in profiling of a node's hot paths, switched on and off while it runs.
+
+Functions decorated with `PROFILER.section(name)` cost one attribute check
+while profiling is off. Once `PROFILER.start()` is called they are profiled
+in one of two modes:
+
+* 'cprofile' runs them under cProfile and `stop()` writes a `.pstats` file
+  for `python3 -m pstats` or snakeviz. Only one thread is profiled at a
+  time, so calls made while another thread is being profiled run as usual
+* 'sample' has a background thread take the stack of every thread that is
+  inside a section every few milliseconds. `stop()` writes the counts as
+  collapsed stacks, one `frame;frame;frame count` line each, for
+  flamegraph.pl or speedscope
+
+Like metrics.py nothing here imports Flask until `install()` is called.
+basic_wallet_p's asyncio server does what `install()` does with its own
+routes.
+"""
+import cProfile
+import sys
+
+from atexit import register
+from collections import defaultdict
+from functools import wraps
+from inspect import iscoroutinefunction
+from os import getpid, makedirs, path
+from threading import Event, Lock, Thread, get_ident, local
+from time import strftime
+from types import coroutine
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+MODES = ('cprofile', 'sample')
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+class ProfilerError(Exception):
+    """
+    Raised when profiling can not be started as asked
+    """
+
+
+class Profiler():
+    def __init__(self, directory: str = 'profiles', interval: float = SAMPLE_INTERVAL):
+        """
+        :param directory: <str> Where profiles are written
+        :param interval: (Optional) <float> Seconds between samples
+        """
+        self.directory = directory
+        self.interval = interval
+        self.mode: Optional[str] = None
+        self.started: str = None
+        self.lock = Lock()
+        # Held by the one thread running under cProfile
+        self.profiling = Lock()
+        self.profile: cProfile.Profile = None
+        # Per thread id, the section being run and the frame it was entered from
+        self.sections: Dict[int, Tuple[str, object]] = {}
+        self.stacks: Dict[str, int] = defaultdict(int)
+        self.stopped = Event()
+        self.sampler: Thread = None
+        self.local = local()
+
+    def start(self, mode: str):
+        """
+        :param mode: <str> 'cprofile' or 'sample'
+        :raises ProfilerError: If the mode is unknown or profiling is on
+        """
+        if mode not in MODES:
+            raise ProfilerError(f"Unknown profiling mode {mode!r}, expected one of {', '.join(MODES)}")
+        with self.lock:
+            if self.mode is not None:
+                raise ProfilerError(f"Already profiling with {self.mode}")
+            self.started = strftime('%Y%m%d-%H%M%S')
+            if mode == 'cprofile':
+                self.profile = cProfile.Profile()
+            else:
+                self.stacks = defaultdict(int)
+                self.stopped = Event()
+                self.sampler = Thread(target=self.sample, daemon=True)
+                self.sampler.start()
+            self.mode = mode
+
+    def stop(self) -> Optional[str]:
+        """
+        Stops profiling and writes out what was collected
+
+        :return: <str> The file written, or None if profiling was off
+        """
+        with self.lock:
+            mode, self.mode = self.mode, None
+            if mode is None:
+                return None
+
+            makedirs(self.directory, exist_ok=True)
+            base = path.join(self.directory, f'{self.started}-{getpid()}')
+            if mode == 'cprofile':
+                # Waits for the call being profiled to finish
+                with self.profiling:
+                    profile, self.profile = self.profile, None
+                file = f'{base}.pstats'
+                profile.dump_stats(file)
+            else:
+                self.stopped.set()
+                self.sampler.join()
+                file = f'{base}.collapsed'
+                with open(file, 'w') as f:
+                    for stack, count in sorted(self.stacks.items()):
+                        f.write(f'{stack} {count}\n')
+            return file
+
+    def status(self) -> dict:
+        return {'mode': self.mode, 'started': self.started if self.mode else None, 'directory': self.directory}
+
+    def section(self, name: str) -> Callable:
+        """
+        Decorates a function to be profiled under `name` while profiling is
+        on. Sections called from inside another are part of the outer one.
+        A coroutine function is profiled one step at a time, see `steps()`
+        """
+        def decorate(function: Callable) -> Callable:
+            if iscoroutinefunction(function):
+                @wraps(function)
+                async def stepped(*args, **kwargs):
+                    return await self.steps(name, function(*args, **kwargs))
+                return stepped
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if self.mode is None or getattr(self.local, 'inside', False):
+                    return function(*args, **kwargs)
+                return self.run(name, function, args, kwargs)
+            return wrapper
+        return decorate
+
+    @coroutine
+    def steps(self, name: str, awaited):
+        """
+        Awaits a coroutine, running each of its steps as the section `name`.
+        Other coroutines run on the event loop between its steps, so only
+        the time it spends on the loop's thread itself is profiled
+        """
+        send, value = awaited.send, None
+        while True:
+            try:
+                if self.mode is None or getattr(self.local, 'inside', False):
+                    future = send(value)
+                else:
+                    future = self.run(name, send, (value,), {})
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value = yield future
+                send = awaited.send
+            except BaseException as error:
+                send, value = awaited.throw, error
+
+    def run(self, name: str, function: Callable, args, kwargs):
+        self.local.inside = True
+        try:
+            if self.mode == 'sample':
+                ident = get_ident()
+                self.sections[ident] = (name, sys._getframe())
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.sections.pop(ident, None)
+
+            if not self.profiling.acquire(blocking=False):
+                return function(*args, **kwargs)
+            try:
+                profile = self.profile
+                if profile is None:
+                    return function(*args, **kwargs)
+                profile.enable()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    profile.disable()
+            finally:
+                self.profiling.release()
+        finally:
+            self.local.inside = False
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, (name, entered) in list(self.sections.items()):
+                frame = frames.get(ident)
+                names = []
+                # Only the frames below the section's own entry
+                while frame is not None and frame is not entered:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if frame is None:
+                    # The thread left the section since it was looked up
+                    continue
+                names.append(name)
+                self.stacks[';'.join(reversed(names))] += 1
+
+
+PROFILER = Profiler()
+
+
+def configure(environ: Mapping[str, str], profiler: Profiler = PROFILER):
+    """
+    Profiles the hot paths from the start when `PROFILE` is set, IE
+    `PROFILE=sample python3 blockchain.py`, writing to `PROFILE_DIR`
+    (`profiles` by default) when profiling stops or the process exits
+    """
+    profiler.directory = environ.get('PROFILE_DIR', profiler.directory)
+    if 'PROFILE' in environ:
+        profiler.start(environ['PROFILE'])
+    register(profiler.stop)
+
+
+def install(app, profiler: Profiler = PROFILER):
+    """
+    Profiles every request `app` handles as the 'request' section and adds
+    `/admin/profile`, which only answers requests from the node's own host:
+
+    * `GET` tells whether profiling is on
+    * `POST {"mode": "cprofile"}` or `{"mode": "sample"}` switches it on
+    * `POST {"mode": "off"}` switches it off and says which file it wrote
+    """
+    from flask import jsonify, request
+
+    handle = app.wsgi_app
+    profiled = profiler.section('request')(handle)
+
+    def dispatch(environ, start_response):
+        # Stopping from inside a profiled request would wait on itself
+        if environ.get('PATH_INFO') == '/admin/profile':
+            return handle(environ, start_response)
+        return profiled(environ, start_response)
+
+    app.wsgi_app = dispatch
+
+    @app.route('/admin/profile', methods=['GET', 'POST'])
+    def admin_profile():
+        if request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({'message': "Profiling can only be switched from the node's host"}), 403
+
+        if request.method == 'POST':
+            mode = (request.get_json(silent=True) or {}).get('mode')
+            if mode == 'off':
+                return jsonify({**profiler.status(), 'file': profiler.stop()}), 200
+            try:
+                profiler.start(mode)
+            except ProfilerError as error:
+                return jsonify({'message': str(error)}), 400
+        return jsonify(profiler.status()), 200
+
+    return app
@@ -0,0 +1,186 @@
+"""
+Storage backends for `Blockchain.chain`.
+
+A plain list keeps the chain in memory. `LogStorage` keeps it on disk so a
+node can restart without losing its ledger:
+
+* `<path>.log` holds every block's serialized bytes, each prefixed with its
+  length as a 4 byte big-endian integer, appended in chain order.
+* `<path>.idx` holds the byte offset of every record in the log as 8 byte
+  unsigned integers, so block `n` can be found without scanning.
+
+Reads go through an mmap of the log and blocks are only decoded when they
+are asked for, so reopening a long chain is a couple of file reads.
+"""
+import mmap
+import os
+
+from array import array
+from threading import Lock
+from struct import Struct
+from typing import Callable, Iterator
+
+LENGTH = Struct('>I')
+
+
+class LogStorage():
+    def __init__(self, path: str, decode: Callable[[bytes], object], sync_every: int = 32):
+        """
+        :param path: <str> Path prefix for the `.log` and `.idx` files
+        :param decode: <callable> Turns a record's bytes back into a Block
+        :param sync_every: <int> How many appends to batch between fsyncs
+        """
+        self.decode = decode
+        self.sync_every = sync_every
+        self.pending = 0
+        self.map = None
+        self.remap_lock = Lock()
+        self.tip = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.log = open(f'{path}.log', 'a+b')
+        self.idx = open(f'{path}.idx', 'a+b')
+        self.offsets = array('Q')
+        self.recover()
+
+    def recover(self):
+        """
+        Loads the offset index and repairs the files after a crash: any
+        offsets the index is missing are rebuilt from the log's length
+        prefixes and a partially written trailing record is cut off.
+        """
+        self.idx.seek(0)
+        raw = self.idx.read()
+        self.offsets.frombytes(raw[:len(raw) - len(raw) % self.offsets.itemsize])
+
+        self.log.seek(0, os.SEEK_END)
+        log_size = self.log.tell()
+
+        # Drop index entries whose record did not fully make it to the log
+        while self.offsets and self.record_end(self.offsets[-1], log_size) is None:
+            self.offsets.pop()
+
+        end = self.record_end(self.offsets[-1], log_size) if self.offsets else 0
+        while end + LENGTH.size <= log_size:
+            record_end = self.record_end(end, log_size)
+            if record_end is None:
+                break
+            self.offsets.append(end)
+            end = record_end
+
+        self.size = end
+        if end != log_size:
+            self.log.truncate(end)
+        if len(raw) != len(self.offsets) * self.offsets.itemsize:
+            self.idx.truncate(0)
+            self.idx.write(self.offsets.tobytes())
+        self.sync()
+
+    def record_end(self, offset: int, log_size: int):
+        """
+        :return: The offset just past the record at `offset`, or None if
+        the record is cut short by the end of the log
+        """
+        if offset + LENGTH.size > log_size:
+            return None
+        self.log.seek(offset)
+        length, = LENGTH.unpack(self.log.read(LENGTH.size))
+        end = offset + LENGTH.size + length
+        return end if end <= log_size else None
+
+    def append(self, block):
+        data = block.encode()
+        self.log.write(LENGTH.pack(len(data)))
+        self.log.write(data)
+        self.idx.write(array('Q', [self.size]).tobytes())
+        self.offsets.append(self.size)
+        self.size += LENGTH.size + len(data)
+        self.tip = block
+
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def truncate(self, length: int):
+        """
+        Drops every block from index `length` on, for when a longer chain
+        replaces the end of this one. Must not race with readers.
+        """
+        if length >= len(self):
+            return
+
+        self.log.flush()
+        self.idx.flush()
+        self.size = self.offsets[length]
+        del self.offsets[length:]
+        self.log.truncate(self.size)
+        self.idx.truncate(length * self.offsets.itemsize)
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.tip = None
+        self.sync()
+
+    def sync(self):
+        """
+        Flushes and fsyncs both files
+        """
+        for f in (self.log, self.idx):
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = 0
+
+    def close(self):
+        if self.log.closed:
+            return
+        self.sync()
+        if self.map is not None:
+            self.map.close()
+        self.log.close()
+        self.idx.close()
+
+    def raw(self, index: int) -> bytes:
+        """
+        :return: The serialized bytes of the block at `index`
+        """
+        offset = self.offsets[index]
+        log_map = self.map
+        if log_map is None or offset >= len(log_map):
+            log_map = self.remap(offset)
+        length, = LENGTH.unpack_from(log_map, offset)
+        start = offset + LENGTH.size
+        return log_map[start:start + length]
+
+    def remap(self, offset: int):
+        """
+        Maps the log again once it has grown past `offset`. Several readers
+        may get here at once, so the old map is left for the garbage
+        collector rather than closed under a reader that is still using it.
+        """
+        with self.remap_lock:
+            if self.map is None or offset >= len(self.map):
+                self.log.flush()
+                self.map = mmap.mmap(self.log.fileno(), self.size, access=mmap.ACCESS_READ)
+            return self.map
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('block index out of range')
+
+        if index == len(self) - 1:
+            if self.tip is None:
+                self.tip = self.decode(self.raw(index))
+            return self.tip
+        return self.decode(self.raw(index))
+
+    def __iter__(self) -> Iterator:
+        for index in range(len(self)):
+            yield self[index]
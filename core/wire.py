@@ -0,0 +1,341 @@
+"""
+A compact binary encoding for blocks and transactions, offered next to JSON.
+Clients ask for it with `Accept: application/octet-stream`.
+
+Values are tagged with one byte: integers are zigzag varints, floats are 8
+byte doubles, strings are length prefixed and 64 character hex digests are
+sent as their 32 raw bytes. Dict keys the chain uses are sent as one byte.
+
+A block is a version byte, a dict of its header fields and then its
+transactions, either column-wise (a table of the addresses in the block,
+sender and receiver indexes into it and an array of amounts) or as one
+generic list. A chain is a run of blocks, each prefixed with its length.
+
+Decoding gives back exactly the fields of the JSON form in the same order,
+so `canonical(fields)` rebuilds the bytes a node hashes whichever form a
+client downloaded.
+"""
+import re
+import sys
+
+from array import array
+from json import dumps
+from struct import Struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+MIMETYPE = 'application/octet-stream'
+VERSION = 1
+
+KEYS = ('amount', 'difficulty', 'index', 'merkle_root', 'miner', 'previous_hash', 'proof', 'receiver', 'sender',
+        'timestamp', 'transations')
+KEY_IDS = {key: number for number, key in enumerate(KEYS)}
+
+# Value tags
+NONE, FALSE, TRUE, INT, FLOAT, STR, DIGEST, LIST, DICT, KEY = range(10)
+# How a block's transactions follow its header
+HEADER_ONLY, LISTED, COLUMNS = range(3)
+
+DIGEST_PATTERN = re.compile('[0-9a-f]{64}')
+DOUBLE = Struct('<d')
+LENGTH = Struct('>I')
+
+
+class WireError(Exception):
+    """
+    Raised when bytes are not a valid encoding
+    """
+
+
+def canonical(fields: dict) -> bytes:
+    """
+    The bytes a block's hash and proofs are computed over: its fields as
+    JSON, in the order given. Nodes and miners both build them here
+    """
+    return dumps(fields).encode('utf-8')
+
+
+def prefers_binary(accept: str) -> bool:
+    """
+    :param accept: <str> A request's Accept header
+    :return: True if it ranks the binary encoding above JSON. Wildcards
+    rank both the same, which keeps JSON the default
+    """
+    best = {'application/json': 0.0, MIMETYPE: 0.0}
+    for media_range in accept.split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        for candidate in best:
+            if media_type in (candidate, candidate.split('/')[0] + '/*', '*/*'):
+                # An exact match outranks a wildcard
+                rank = quality + (0.001 if media_type == candidate else 0)
+                best[candidate] = max(best[candidate], rank)
+    return best[MIMETYPE] > best['application/json']
+
+
+def write_varint(out: bytearray, number: int):
+    while number > 0x7f:
+        out.append(number & 0x7f | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def pack(out: bytearray, value):
+    """
+    Appends a tagged value to `out`
+    """
+    if value is None:
+        out.append(NONE)
+    elif value is False or value is True:
+        out.append(TRUE if value else FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, str):
+        if len(value) == 64 and DIGEST_PATTERN.fullmatch(value):
+            out.append(DIGEST)
+            out += bytes.fromhex(value)
+        else:
+            encoded = value.encode('utf-8')
+            out.append(STR)
+            write_varint(out, len(encoded))
+            out += encoded
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        write_varint(out, len(value))
+        for item in value:
+            pack(out, item)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        write_varint(out, len(value))
+        for key, item in value.items():
+            if key in KEY_IDS:
+                out.append(KEY)
+                out.append(KEY_IDS[key])
+            else:
+                pack(out, key)
+            pack(out, item)
+    else:
+        raise TypeError(f'Can not encode {type(value).__name__}')
+
+
+def unpack(data: bytes, offset: int):
+    """
+    :return: The tagged value at `offset` and the offset just past it
+    """
+    tag = data[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag in (FALSE, TRUE):
+        return tag == TRUE, offset
+    if tag == INT:
+        number, offset = read_varint(data, offset)
+        return (number >> 1) ^ -(number & 1), offset
+    if tag == FLOAT:
+        if offset + DOUBLE.size > len(data):
+            raise WireError('Float runs past the end of the data')
+        return DOUBLE.unpack_from(data, offset)[0], offset + DOUBLE.size
+    if tag == STR:
+        length, offset = read_varint(data, offset)
+        if offset + length > len(data):
+            raise WireError('String runs past the end of the data')
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+    if tag == DIGEST:
+        if offset + 32 > len(data):
+            raise WireError('Digest runs past the end of the data')
+        return bytes(data[offset:offset + 32]).hex(), offset + 32
+    if tag == LIST:
+        length, offset = read_varint(data, offset)
+        items = []
+        for _ in range(length):
+            item, offset = unpack(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == DICT:
+        length, offset = read_varint(data, offset)
+        fields = {}
+        for _ in range(length):
+            if data[offset] == KEY:
+                key, offset = KEYS[data[offset + 1]], offset + 2
+            else:
+                key, offset = unpack(data, offset)
+            fields[key], offset = unpack(data, offset)
+        return fields, offset
+    raise WireError(f'Unknown tag {tag}')
+
+
+def pack_columns(out: bytearray, transactions: Iterable[Tuple[object, object, float]]):
+    """
+    Appends `(sender, receiver, amount)` transactions column-wise
+    """
+    table = {}
+    senders, receivers, amounts = array('I'), array('I'), array('d')
+    for sender, receiver, amount in transactions:
+        senders.append(table.setdefault(sender, len(table)))
+        receivers.append(table.setdefault(receiver, len(table)))
+        amounts.append(amount)
+
+    write_varint(out, len(amounts))
+    write_varint(out, len(table))
+    for address in table:
+        pack(out, address)
+    for column in (senders, receivers, amounts):
+        if sys.byteorder == 'big':
+            column.byteswap()
+        out += column.tobytes()
+
+
+def unpack_columns(data: bytes, offset: int) -> Tuple[List[dict], int]:
+    """
+    :return: The transactions at `offset` as dicts, with whole amounts as
+    ints the way a node serializes them, and the offset just past them
+    """
+    count, offset = read_varint(data, offset)
+    size, offset = read_varint(data, offset)
+    table = []
+    for _ in range(size):
+        address, offset = unpack(data, offset)
+        table.append(address)
+
+    columns = []
+    for typecode in ('I', 'I', 'd'):
+        column = array(typecode)
+        end = offset + count * column.itemsize
+        if end > len(data):
+            raise WireError('Transactions run past the end of the data')
+        column.frombytes(data[offset:end])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        offset = end
+
+    senders, receivers, amounts = columns
+    if count and max(max(senders), max(receivers)) >= size:
+        raise WireError('Transaction refers to an address that is not in the table')
+    transactions = [{'amount': int(amount) if amount.is_integer() else amount,
+                     'receiver': table[receiver],
+                     'sender': table[sender]}
+                    for sender, receiver, amount in zip(senders, receivers, amounts)]
+    return transactions, offset
+
+
+def encode_block(header: dict, transactions: Iterable[Tuple[object, object, float]] = None,
+                 listed: Optional[list] = None) -> bytes:
+    """
+    :param header: <dict> Every field but the transactions, in canonical order
+    :param transactions: (Optional) <iterable> `(sender, receiver, amount)`
+    for each transaction, sent column-wise
+    :param listed: (Optional) <list> Transactions of any other shape, sent
+    as a generic list. With neither, only the header is sent
+    """
+    out = bytearray([VERSION])
+    pack(out, header)
+    if transactions is not None:
+        out.append(COLUMNS)
+        pack_columns(out, transactions)
+    elif listed is not None:
+        out.append(LISTED)
+        pack(out, listed)
+    else:
+        out.append(HEADER_ONLY)
+    return bytes(out)
+
+
+def decode_block(data: bytes) -> dict:
+    """
+    :return: <dict> The block's fields in canonical order, with its
+    transactions under 'transations' unless only the header was sent
+    :raises WireError: If `data` is not an encoded block
+    """
+    try:
+        if data[0] != VERSION:
+            raise WireError(f'Unknown version {data[0]}')
+        fields, offset = unpack(data, 1)
+        kind = data[offset]
+        if kind == COLUMNS:
+            fields['transations'], offset = unpack_columns(data, offset + 1)
+        elif kind == LISTED:
+            fields['transations'], offset = unpack(data, offset + 1)
+        elif kind != HEADER_ONLY:
+            raise WireError(f'Unknown transactions section {kind}')
+        else:
+            offset += 1
+    except (IndexError, ValueError, TypeError, UnicodeDecodeError, RecursionError) as error:
+        raise WireError(f'Malformed block: {error}')
+    if not isinstance(fields, dict) or offset != len(data):
+        raise WireError('Malformed block')
+    return fields
+
+
+def encode_transactions(transactions: Iterable[Tuple[object, object, float]]) -> bytes:
+    """
+    A batch of `(sender, receiver, amount)` transactions, IE for
+    `/new_transactions`
+    """
+    out = bytearray([VERSION])
+    pack_columns(out, transactions)
+    return bytes(out)
+
+
+def decode_transactions(data: bytes) -> List[dict]:
+    """
+    :raises WireError: If `data` is not an encoded batch of transactions
+    """
+    try:
+        if data[0] != VERSION:
+            raise WireError(f'Unknown version {data[0]}')
+        transactions, offset = unpack_columns(data, 1)
+    except (IndexError, ValueError, TypeError, UnicodeDecodeError, RecursionError) as error:
+        raise WireError(f'Malformed transactions: {error}')
+    if offset != len(data):
+        raise WireError('Malformed transactions')
+    return transactions
+
+
+def record(block: bytes) -> bytes:
+    """
+    Frames one encoded block for a chain
+    """
+    return LENGTH.pack(len(block)) + block
+
+
+def read_records(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Splits a chain into its encoded blocks as the bytes arrive
+
+    :param chunks: <iterable> The chain's bytes, in pieces of any size
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= LENGTH.size:
+            length, = LENGTH.unpack_from(buffer, offset)
+            end = offset + LENGTH.size + length
+            if end > len(buffer):
+                break
+            yield bytes(buffer[offset + LENGTH.size:end])
+            offset = end
+        del buffer[:offset]
+    if buffer:
+        raise WireError('The chain ends part way through a block')
@@ -0,0 +1,53 @@
+"""
+Makes the core package importable the way the nodes do, from the
+repository root, and builds the blocks the tests share.
+"""
+import sys
+
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from core.chain import REWARD, Block, Blockchain, Transaction  # noqa: E402
+
+
+def make_blocks(count: int, transactions: int = 3):
+    """
+    :return: <list> `count` linked Blocks, each with `transactions`
+    transactions. Proofs are not searched for, so they are not valid
+    """
+    blocks = []
+    previous_hash = '1'
+    for index in range(count):
+        block = Block(index, 1700000000.0 + index, index * 7, previous_hash,
+                      [Transaction(f'sender {position}', f'receiver {index}', position + 0.5)
+                       for position in range(transactions)], f'miner {index}', 8)
+        blocks.append(block)
+        previous_hash = block.hash()
+    return blocks
+
+
+@pytest.fixture
+def blocks():
+    return make_blocks(20)
+
+
+def mine_blocks(blockchain: Blockchain, count: int, miner: str = 'miner'):
+    """
+    Mines `count` blocks on `blockchain`. Every block after the first pays
+    'alice' 0.25 from `miner` along with the miner's reward
+    """
+    for _ in range(count):
+        last = blockchain.last_block
+        if last.index:
+            blockchain.new_transaction(miner, 'alice', 0.25)
+        proof = Blockchain.proof_of_work(last)
+        blockchain.new_block(proof, last.hash(), miner, Transaction(f'node {last.index + 1}', miner, REWARD))
+    return blockchain.last_block
+
+
+@pytest.fixture
+def mine():
+    return mine_blocks
@@ -0,0 +1,76 @@
+"""
+Wallet sync cursors: `Blockchain.activity` and `/<address>/sync` only send
+what is new after a cursor, and start over when the chain was replaced.
+"""
+from core.chain import Blockchain
+from core.node import create_app
+
+
+def amounts(activity: dict):
+    return [(found['index'], found['transaction']['amount']) for found in activity['transactions']]
+
+
+def test_cursor_only_sends_what_is_new(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 3)
+
+    first = blockchain.activity('alice')
+    assert amounts(first) == [(2, 0.25), (3, 0.25)]
+    assert first['balance'] == 0.5 and not first['reset']
+    assert first['cursor'] == {'height': 3, 'hash': blockchain.last_block.hash()}
+
+    cursor = first['cursor']
+    assert amounts(blockchain.activity('alice', cursor['height'], cursor['hash'])) == []
+
+    mine(blockchain, 2)
+    second = blockchain.activity('alice', cursor['height'], cursor['hash'])
+    assert amounts(second) == [(4, 0.25), (5, 0.25)]
+    assert second['balance'] == 1.0 and not second['reset']
+    assert second['cursor']['height'] == 5
+
+
+def test_unknown_cursor_resets(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 3)
+
+    for after, after_hash in ((2, 'not the hash'), (10, None)):
+        activity = blockchain.activity('alice', after, after_hash)
+        assert activity['reset']
+        assert amounts(activity) == [(2, 0.25), (3, 0.25)]
+
+
+def test_replaced_chain_resets_the_cursor(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 3)
+    cursor = blockchain.activity('alice')['cursor']
+
+    # The dropped block's payment goes back to the mempool and into a new
+    # block 3 with a different hash
+    with blockchain.lock.write():
+        blockchain.replace_from(3, [])
+    last = blockchain.last_block
+    blockchain.new_block(Blockchain.proof_of_work(last), last.hash(), 'other')
+    assert blockchain.last_block.hash() != cursor['hash']
+
+    activity = blockchain.activity('alice', cursor['height'], cursor['hash'])
+    assert activity['reset']
+    assert amounts(activity) == [(2, 0.25), (3, 0.25)]
+    assert activity['balance'] == 0.5
+
+
+def test_sync_route(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 3)
+    client = create_app(blockchain).test_client()
+
+    response = client.get('/alice/sync')
+    assert response.status_code == 200
+    cursor = response.json['cursor']
+    assert response.json == blockchain.activity('alice')
+
+    mine(blockchain, 1)
+    response = client.get(f"/alice/sync?after={cursor['height']}&hash={cursor['hash']}")
+    assert amounts(response.json) == [(4, 0.25)]
+    assert client.get('/alice/sync?after=2&hash=bad').json['reset']
+    assert client.get('/nobody/sync').json == {'transactions': [], 'balance': 0, 'reset': False,
+                                               'cursor': response.json['cursor']}
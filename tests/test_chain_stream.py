@@ -0,0 +1,78 @@
+"""
+`/chain` fixes its tip and range together and ends its stream cleanly
+when the chain is replaced or shortened while it is being sent.
+"""
+from json import loads
+
+from core import wire
+from core.chain import REWARD, Blockchain, Transaction
+from core.node import create_app
+
+
+def test_stops_where_the_chain_was_replaced(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 6)
+    tip, end, previous_hash = blockchain.chain_range(2)
+    assert (tip, end, previous_hash) == (blockchain.last_block.hash(), 7, blockchain.block(1).hash())
+
+    blocks = blockchain.linked_blocks(2, end, previous_hash)
+    assert next(blocks).index == 2
+    streamed = next(blocks)
+
+    # A fork replaces block 3, which has already been streamed, and grows past the old tip
+    with blockchain.lock.write():
+        blockchain.replace_from(3, [])
+    for _ in range(5):
+        last = blockchain.last_block
+        blockchain.new_block(Blockchain.proof_of_work(last), last.hash(), 'bob',
+                             Transaction(f'node {last.index + 1}', 'bob', REWARD))
+    assert len(blockchain.chain) > end and blockchain.block(3).hash() != streamed.hash()
+    assert list(blocks) == []
+
+
+def test_stops_where_the_chain_got_shorter(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 6)
+    blocks = blockchain.linked_blocks(0, *blockchain.chain_range(0)[1:])
+    streamed = [next(blocks).index for _ in range(3)]
+    with blockchain.lock.write():
+        blockchain.replace_from(4, [])
+    assert streamed + [block.index for block in blocks] == [0, 1, 2, 3]
+
+
+def test_first_block_must_follow_the_block_before_the_range(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 4)
+    assert list(blockchain.linked_blocks(2, 5, 'not the hash')) == []
+    assert [block.index for block in blockchain.linked_blocks(2, 5, blockchain.block(1).hash())] == [2, 3, 4]
+
+
+def test_range_arguments(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 4)
+    assert blockchain.chain_range(1, 2)[1:] == (3, blockchain.block(0).hash())
+    assert blockchain.chain_range(3, -1)[1] == 3
+    assert blockchain.chain_range(9)[1:] == (5, None)
+
+
+def test_chain_route(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 4)
+    client = create_app(blockchain).test_client()
+
+    response = client.get('/chain')
+    assert response.status_code == 200
+    assert response.headers['ETag'] == f'"{blockchain.last_block.hash()}"'
+    assert loads(response.data) == [dict(block) for block in blockchain.chain]
+    assert [block['index'] for block in client.get('/chain?since=2').json] == [3, 4]
+    assert [block['index'] for block in client.get('/chain?start=1&limit=2').json] == [1, 2]
+    assert client.get('/chain?start=9').json == []
+
+    response = client.get('/chain', headers={'If-None-Match': f'"{blockchain.last_block.hash()}"'})
+    assert response.status_code == 304
+
+    response = client.get('/chain?since=1', headers={'Accept': wire.MIMETYPE})
+    assert response.mimetype == wire.MIMETYPE
+    records = list(wire.read_records([response.data]))
+    assert [wire.canonical(wire.decode_block(record)) for record in records] == \
+        [blockchain.block(index).encode() for index in (2, 3, 4)]
@@ -0,0 +1,109 @@
+"""
+The mempool's checks on a transaction, its capacity and the pending amounts
+it keeps per sender.
+"""
+from math import inf, nan
+
+import pytest
+
+from core.chain import Blockchain, Transaction
+from core.mempool import Mempool, MempoolError, check
+
+
+@pytest.mark.parametrize('sender, receiver, amount', [
+    ('alice', 'bob', nan),
+    ('alice', 'bob', inf),
+    ('alice', 'bob', -inf),
+    ('alice', 'bob', 10 ** 400),
+    ('alice', 'bob', 2 ** 53 + 1),
+    ('alice', 'bob', 0),
+    ('alice', 'bob', -1),
+    ('alice', 'bob', True),
+    ('alice', 'bob', '1'),
+    ('alice', 'bob', None),
+    (1, 'bob', 1),
+    ('alice', ['bob'], 1),
+])
+def test_malformed_transactions_are_refused(sender, receiver, amount):
+    with pytest.raises(MempoolError):
+        check(Transaction(sender, receiver, amount))
+
+    mempool = Mempool(10, lambda address: 100)
+    with pytest.raises(MempoolError):
+        mempool.add(Transaction(sender, receiver, amount))
+    assert len(mempool) == 0
+    assert not mempool.pending
+
+
+@pytest.mark.parametrize('amount', [1, 0.25, 2 ** 53, 1e-9])
+def test_well_formed_amounts_are_admitted(amount):
+    check(Transaction('alice', 'bob', amount))
+
+
+def test_resubmitted_transaction_is_kept_once():
+    mempool = Mempool(10)
+    mempool.add(Transaction('alice', 'bob', 1))
+    with pytest.raises(MempoolError, match='already pending'):
+        mempool.add(Transaction('alice', 'bob', 1.0))
+    assert len(mempool) == 1
+
+
+def test_overdrafts_count_what_is_pending():
+    mempool = Mempool(10, lambda address: 3 if address == 'alice' else 0)
+    mempool.add(Transaction('alice', 'bob', 2))
+    with pytest.raises(MempoolError, match='Insufficient funds'):
+        mempool.add(Transaction('alice', 'carol', 2))
+    mempool.add(Transaction('alice', 'carol', 1))
+    with pytest.raises(MempoolError, match='Insufficient funds'):
+        mempool.add(Transaction('bob', 'carol', 1))
+    assert mempool.pending == {'alice': 3}
+
+
+def test_full_pool_drops_the_oldest():
+    mempool = Mempool(3)
+    keys = [mempool.add(Transaction('alice', 'bob', amount)) for amount in (1, 2, 3, 4)]
+    assert [transaction.amount for transaction in mempool] == [2, 3, 4]
+    assert keys[0] not in mempool.transactions
+    assert mempool.pending == {'alice': 9}
+
+
+def test_take_and_discard_release_pending_amounts():
+    mempool = Mempool(10)
+    mempool.add(Transaction('alice', 'bob', 1))
+    second = mempool.add(Transaction('alice', 'bob', 2))
+    mempool.add(Transaction('carol', 'bob', 4))
+
+    assert [transaction.amount for transaction in mempool.take(1)] == [1]
+    mempool.discard(second)
+    mempool.discard(second)
+    assert mempool.pending == {'carol': 4}
+    assert [transaction.amount for transaction in mempool.take(10)] == [4]
+    assert not mempool.pending
+
+
+def test_whole_float_amounts_hash_like_the_block_they_go_into(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 2)
+    transaction = blockchain.new_transaction('miner', 'bob', 1.0)
+    block = mine(blockchain, 1)
+    assert transaction.hash() in [included.hash() for included in block.transactions]
+
+
+def test_batches_report_each_transaction(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 1)
+    results = blockchain.new_transactions([
+        {'sender': 'miner', 'receiver': 'bob', 'amount': 0.5},
+        {'sender': 'miner', 'receiver': 'bob', 'amount': nan},
+        {'sender': 'miner', 'amount': 1},
+        None,
+        {'sender': 'miner', 'receiver': 'bob', 'amount': 5},
+    ])
+    assert results[0] == {'amount': 0.5, 'receiver': 'bob', 'sender': 'miner'}
+    assert [result.get('message') for result in results[1:]] == [
+        "Amount must be a finite number that fits in a double",
+        "A transaction needs a sender, receiver and amount",
+        "A transaction needs a sender, receiver and amount",
+        "Insufficient funds",
+    ]
+    assert len(blockchain.mempool) == 1
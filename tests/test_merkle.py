@@ -0,0 +1,110 @@
+"""
+Merkle proofs that a transaction is in a block, checked against the root
+its header commits to.
+"""
+import pytest
+
+from time import time
+
+from core import merkle
+from core.chain import Block, Blockchain, InvalidBlockError, Transaction
+
+
+def leaves_of(count: int):
+    return [merkle.leaf(f'transaction {position}'.encode('utf-8')) for position in range(count)]
+
+
+def test_empty_root():
+    assert merkle.merkle_root([]) == merkle.EMPTY_ROOT
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 5, 7, 8, 9, 16, 33])
+def test_every_position_proves(count):
+    leaves = leaves_of(count)
+    root = merkle.merkle_root(leaves)
+    for position in range(count):
+        proof = merkle.merkle_proof(leaves, position)
+        assert merkle.verify_proof(f'transaction {position}'.encode('utf-8'), proof, root)
+
+
+@pytest.mark.parametrize('count', [2, 5, 8])
+def test_proofs_do_not_verify_anything_else(count):
+    leaves = leaves_of(count)
+    root = merkle.merkle_root(leaves)
+    proof = merkle.merkle_proof(leaves, 1)
+
+    assert not merkle.verify_proof(b'transaction 0', proof, root)
+    assert not merkle.verify_proof(b'transaction 1', proof, merkle.merkle_root(leaves[:-1] + leaves[:1]))
+
+    side, sibling = proof[0]
+    flipped = [('right' if side == 'left' else 'left', sibling)] + proof[1:]
+    assert not merkle.verify_proof(b'transaction 1', flipped, root)
+    tampered = [(side, merkle.leaf(b'other').hex())] + proof[1:]
+    assert not merkle.verify_proof(b'transaction 1', tampered, root)
+
+
+def test_block_commits_to_its_transactions(blocks):
+    block = blocks[5]
+    assert block.merkle_root == merkle.merkle_root(block.leaves())
+
+    for position, transaction in enumerate(block.transactions):
+        proof = merkle.merkle_proof(block.leaves(), position)
+        assert merkle.verify_proof(str(transaction).encode('utf-8'), proof, block.merkle_root)
+
+    # Changing a transaction changes the root and so the block's hash
+    changed = Block(block.index, block.timestamp, block.proof, block.previous_hash,
+                    [Transaction('sender 0', 'receiver 5', 99)] + list(block.transactions)[1:], block.miner,
+                    block.difficulty)
+    assert changed.merkle_root != block.merkle_root
+    assert changed.hash() != block.hash()
+
+
+def test_pruned_block_keeps_its_root_and_hash(blocks):
+    block = blocks[5]
+    pruned = block.prune()
+    assert pruned.pruned and not block.pruned
+    assert pruned.merkle_root == block.merkle_root
+    assert pruned.hash() == block.hash()
+
+
+def test_inclusion_proof_round_trip(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 4)
+
+    for index in range(1, len(blockchain)):
+        block = blockchain.block(index)
+        for transaction in block.transactions:
+            inclusion = blockchain.inclusion_proof(index, transaction.hash())
+            assert inclusion['header'] == dict(block.header())
+            assert inclusion['previous_header'] == dict(blockchain.block(index - 1).header())
+            assert inclusion['transaction'] == dict(transaction)
+            assert merkle.verify_proof(str(transaction).encode('utf-8'), inclusion['proof'],
+                                       inclusion['header']['merkle_root'])
+
+    assert blockchain.inclusion_proof(2, Transaction('nobody', 'alice', 1).hash()) is None
+
+
+def test_block_that_repeats_a_transaction_is_refused(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 2)
+    blockchain.new_transaction('miner', 'bob', 0.25)
+    mine(blockchain, 1)
+    last = blockchain.last_block
+    transactions = list(last.transactions)
+    assert len(transactions) == 3
+
+    # Repeating the last of an odd number of transactions keeps the root,
+    # so the padded block hashes the same as the real one
+    padded = Block(last.index, last.timestamp, last.proof, last.previous_hash, transactions + transactions[-1:],
+                   last.miner, last.difficulty)
+    assert padded.hash() == last.hash()
+
+    previous = blockchain.block(last.index - 1)
+    assert blockchain.check_block(dict(last), previous, [], previous.index, time()).hash() == last.hash()
+    with pytest.raises(InvalidBlockError, match='repeats a transaction'):
+        blockchain.check_block(dict(padded), previous, [], previous.index, time())
+
+
+def test_odd_levels_pad_with_the_last_leaf():
+    a, b, c = leaves_of(3)
+    assert merkle.merkle_root([a, b, c]) == merkle.merkle_root([a, b, c, c])
@@ -0,0 +1,126 @@
+"""
+The routes `create_app` serves, through Flask's test client. Which routes
+an app has follows from its chain and `client_mining`.
+"""
+import pytest
+
+from core import wire
+from core.chain import Blockchain
+from core.node import create_app
+
+
+@pytest.fixture
+def blockchain(mine):
+    blockchain = Blockchain(difficulty=4)
+    mine(blockchain, 3)
+    return blockchain
+
+
+@pytest.fixture
+def client(blockchain):
+    return create_app(blockchain).test_client()
+
+
+def test_last_block(client, blockchain):
+    response = client.get('/last_block')
+    assert response.status_code == 200
+    assert response.json == dict(blockchain.last_block.header())
+
+    response = client.get('/last_block/wait?hash=not-the-tip&timeout=1')
+    assert response.json['index'] == 3
+
+
+def test_new_transaction(client, blockchain):
+    response = client.post('/new_transaction', json={'sender': 'miner', 'receiver': 'bob', 'amount': 0.5})
+    assert response.status_code == 200
+    assert response.json == {'sender': 'miner', 'receiver': 'bob', 'amount': 0.5}
+    assert len(blockchain.mempool) == 1
+
+    response = client.post('/new_transaction', data='{"sender": "miner", "receiver": "bob", "amount": NaN}',
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert 'finite' in response.json['message']
+
+    response = client.post('/new_transaction', json={'sender': 'nobody', 'receiver': 'bob', 'amount': 1})
+    assert response.status_code == 400
+    assert len(blockchain.mempool) == 1
+
+
+def test_new_transactions(client, blockchain):
+    response = client.post('/new_transactions', json=[{'sender': 'miner', 'receiver': 'bob', 'amount': 0.5},
+                                                       {'sender': 'miner'}])
+    assert response.status_code == 200
+    assert response.json == [{'sender': 'miner', 'receiver': 'bob', 'amount': 0.5},
+                             {'message': "A transaction needs a sender, receiver and amount"}]
+
+    lines = b'{"sender": "miner", "receiver": "carol", "amount": 0.25}\nnot json\n\n'
+    response = client.post('/new_transactions', data=lines, content_type='application/x-ndjson')
+    assert [sorted(result) for result in response.json] == [['amount', 'receiver', 'sender'], ['message']]
+
+    response = client.post('/new_transactions', data=wire.encode_transactions([('miner', 'dave', 0.125)]),
+                           content_type=wire.MIMETYPE)
+    assert response.json == [{'sender': 'miner', 'receiver': 'dave', 'amount': 0.125}]
+    assert len(blockchain.mempool) == 3
+
+    response = client.post('/new_transactions', data=b'\x09garbage', content_type=wire.MIMETYPE)
+    assert response.status_code == 400
+    assert client.post('/new_transactions', json={'sender': 'miner'}).status_code == 400
+
+
+def test_inclusion_proof(client, blockchain):
+    transaction = blockchain.block(2).transactions[0]
+    response = client.get(f'/block/2/proof/{transaction.hash()}')
+    assert response.status_code == 200
+    proof = blockchain.inclusion_proof(2, transaction.hash())
+    assert response.json['proof'] == [list(step) for step in proof['proof']]
+
+    assert client.get(f'/block/9/proof/{transaction.hash()}').status_code == 404
+    response = client.get(f'/block/1/proof/{transaction.hash()}')
+    assert response.status_code == 404
+    assert response.json == {'message': "The block does not hold that transaction"}
+
+
+def test_wallet_routes(client, blockchain):
+    assert client.get('/miner/balance').json == blockchain.balance('miner')
+    assert client.get('/alice/balance').json == 0.5
+    assert client.get('/alice/transactions').json == [{'sender': 'miner', 'receiver': 'alice', 'amount': 0.25}] * 2
+
+    activity = client.get('/alice/sync?after=2').json
+    assert activity == blockchain.activity('alice', 2, None)
+
+
+def test_peer_routes(client, blockchain):
+    assert client.get('/status').json == {'length': 4, 'tip': blockchain.last_block.hash(), 'work': blockchain.work}
+    assert client.get('/hashes?start=1&limit=2').json == [blockchain.block(1).hash(), blockchain.block(2).hash()]
+    assert client.get('/hashes?start=9').json == []
+
+    assert client.post('/nodes/register', json={'nodes': 'http://a'}).status_code == 400
+    response = client.post('/nodes/register', json={'nodes': ['http://peer:5000']})
+    assert response.status_code == 200
+    assert response.json == {'nodes': sorted(blockchain.nodes)}
+
+
+def test_metrics_and_profile(client):
+    client.get('/last_block')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_count{' in response.get_data(as_text=True)
+
+    response = client.get('/admin/profile')
+    assert response.status_code == 200
+    response = client.get('/admin/profile', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert response.status_code == 403
+
+
+def test_routes_follow_the_chain():
+    client = create_app(Blockchain(transactions=False, wallet=False, difficulty=4)).test_client()
+    assert client.get('/last_block').status_code == 200
+    assert client.post('/new_transaction', json={}).status_code == 404
+    assert client.get('/status').status_code == 404
+
+    blockchain = Blockchain(difficulty=4)
+    client = create_app(blockchain, client_mining=False).test_client()
+    assert client.get('/last_block').status_code == 404
+    response = client.get('/mine')
+    assert response.status_code == 200
+    assert response.json['index'] == 1 == blockchain.last_block.index
@@ -0,0 +1,120 @@
+"""
+Snapshots of a wallet's derived state, pruning, and restarting from them
+with and without the chain on disk.
+"""
+import pytest
+
+from core.chain import Block, Blockchain
+from core.storage import LogStorage
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'chain'), str(tmp_path / 'snapshot.json')
+
+
+def open_chain(paths, prune=False, stored=True, decoded=None):
+    """
+    :param decoded: (Optional) <list> Collects the index of every block
+    decoded from storage
+    """
+    chain, snapshot = paths
+
+    def decode(data):
+        block = Block.decode(data)
+        if decoded is not None:
+            decoded.append(block.index)
+        return block
+
+    storage = LogStorage(chain, decode) if stored else None
+    # Snapshots are taken by hand, not on a thread
+    return Blockchain(storage, difficulty=4, snapshot_path=snapshot, snapshot_every=10 ** 9, prune=prune)
+
+
+def state(blockchain: Blockchain):
+    return (len(blockchain.transactions('alice')), blockchain.balance('alice'), blockchain.balance('miner'),
+            blockchain.work)
+
+
+def checkpointed(paths, mine, prune=False, count=6):
+    blockchain = open_chain(paths, prune)
+    mine(blockchain, count)
+    blockchain.checkpoint()
+    mine(blockchain, 2)
+    return blockchain
+
+
+def test_stored_chain_keeps_its_whole_history(paths, mine):
+    blockchain = checkpointed(paths, mine)
+    before = state(blockchain)
+    blockchain.chain.close()
+
+    blockchain = open_chain(paths)
+    assert blockchain.pruned_height == 0
+    assert state(blockchain) == before
+    blockchain.chain.close()
+
+
+def test_pruning_stored_chain_starts_from_the_snapshot(paths, mine):
+    blockchain = checkpointed(paths, mine, prune=True)
+    height = blockchain.pruned_height
+    assert height == 7
+    balances = blockchain.balance('alice'), blockchain.balance('miner')
+    work = blockchain.work
+    history = [dict(transaction) for transaction in blockchain.transactions('alice')]
+    blockchain.chain.close()
+
+    decoded = []
+    blockchain = open_chain(paths, prune=True, decoded=decoded)
+    # Only the snapshot's tip and the blocks after it were read
+    assert min(decoded) == height - 1
+    assert blockchain.pruned_height == height
+    assert (blockchain.balance('alice'), blockchain.balance('miner')) == balances
+    assert blockchain.work == work == blockchain.work_between(1, len(blockchain))
+    assert [dict(transaction) for transaction in blockchain.transactions('alice')] == history
+    blockchain.chain.close()
+
+
+def test_prune_keeps_hashes_and_balances(paths, mine):
+    blockchain = open_chain(paths, prune=True, stored=False)
+    mine(blockchain, 6)
+    hashes = [block.hash() for block in blockchain.chain]
+    balance = blockchain.balance('alice')
+
+    blockchain.checkpoint()
+    assert blockchain.pruned_height == 7
+    assert all(blockchain.block(index).pruned for index in range(1, 7))
+    assert [block.hash() for block in blockchain.chain] == hashes
+    assert blockchain.balance('alice') == balance
+    assert blockchain.transactions('alice') == []
+
+    mine(blockchain, 1)
+    assert blockchain.balance('alice') == balance + 0.25
+    assert len(blockchain.transactions('alice')) == 1
+
+
+def test_new_node_starts_from_the_snapshot_alone(paths, mine):
+    blockchain = checkpointed(paths, mine)
+    snapshot = blockchain.snapshot()
+    blockchain.chain.close()
+    Blockchain.save_snapshot(paths[1], snapshot)
+
+    fresh = open_chain(paths, stored=False)
+    assert len(fresh) == snapshot['height']
+    assert fresh.last_block.hash() == snapshot['tip']
+    assert fresh.balance('alice') == snapshot['balances']['alice']
+    assert fresh.work == blockchain.work
+
+    # A stored chain filled from the snapshot is partly headers after a restart
+    chain, _ = paths
+    for suffix in ('.log', '.idx'):
+        open(chain + suffix, 'w').close()
+    filled = open_chain(paths)
+    mine(filled, 3)
+    before = state(filled)
+    filled.chain.close()
+
+    restarted = open_chain(paths)
+    assert restarted.pruned_height == snapshot['height']
+    assert state(restarted) == before
+    restarted.chain.close()
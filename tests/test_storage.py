@@ -0,0 +1,131 @@
+"""
+LogStorage round trips, and how it recovers from a log and index left
+behind by a crash.
+"""
+import os
+
+import pytest
+
+from core.chain import Block
+from core.storage import LENGTH, LogStorage
+
+
+@pytest.fixture
+def prefix(tmp_path):
+    return str(tmp_path / 'chain')
+
+
+def open_storage(prefix: str) -> LogStorage:
+    return LogStorage(prefix, Block.decode)
+
+
+def fill(prefix: str, blocks) -> LogStorage:
+    storage = open_storage(prefix)
+    for block in blocks:
+        storage.append(block)
+    return storage
+
+
+def test_round_trip(prefix, blocks):
+    fill(prefix, blocks).close()
+
+    storage = open_storage(prefix)
+    assert len(storage) == len(blocks)
+    assert [storage.raw(index) for index in range(len(storage))] == [block.encode() for block in blocks]
+    assert [block.hash() for block in storage] == [block.hash() for block in blocks]
+    assert storage[-1].hash() == blocks[-1].hash()
+    with pytest.raises(IndexError):
+        storage[len(blocks)]
+    storage.close()
+
+
+@pytest.mark.parametrize('torn', [1, LENGTH.size - 1, LENGTH.size, LENGTH.size + 10])
+def test_torn_tail_record_is_cut_off(prefix, blocks, torn):
+    fill(prefix, blocks).close()
+    size = os.path.getsize(f'{prefix}.log')
+    extra = blocks[0].encode()
+    with open(f'{prefix}.log', 'ab') as f:
+        f.write((LENGTH.pack(len(extra)) + extra)[:torn])
+
+    storage = open_storage(prefix)
+    assert len(storage) == len(blocks)
+    assert os.path.getsize(f'{prefix}.log') == size
+
+    # The chain carries on where the torn record was
+    storage.append(blocks[0])
+    assert storage.raw(len(blocks)) == extra
+    storage.close()
+    assert len(open_storage(prefix)) == len(blocks) + 1
+
+
+@pytest.mark.parametrize('kept', [0, 1, 12])
+def test_short_index_is_rebuilt_from_the_log(prefix, blocks, kept):
+    fill(prefix, blocks).close()
+    with open(f'{prefix}.idx', 'r+b') as f:
+        f.truncate(kept * 8)
+
+    storage = open_storage(prefix)
+    assert len(storage) == len(blocks)
+    assert storage.raw(len(blocks) - 1) == blocks[-1].encode()
+    storage.close()
+    assert os.path.getsize(f'{prefix}.idx') == len(blocks) * 8
+
+
+def test_partial_index_entry_is_dropped(prefix, blocks):
+    fill(prefix, blocks).close()
+    with open(f'{prefix}.idx', 'ab') as f:
+        f.write(b'\x00\x01\x02')
+
+    storage = open_storage(prefix)
+    assert len(storage) == len(blocks)
+    storage.close()
+    assert os.path.getsize(f'{prefix}.idx') == len(blocks) * 8
+
+
+def test_long_index_loses_records_missing_from_the_log(prefix, blocks):
+    storage = fill(prefix, blocks)
+    cut = storage.offsets[15]
+    storage.close()
+    # The index made it to disk but the last records did not
+    with open(f'{prefix}.log', 'r+b') as f:
+        f.truncate(cut + LENGTH.size + 1)
+
+    storage = open_storage(prefix)
+    assert len(storage) == 15
+    assert storage[-1].hash() == blocks[14].hash()
+    storage.close()
+    assert os.path.getsize(f'{prefix}.log') == cut
+    assert os.path.getsize(f'{prefix}.idx') == 15 * 8
+
+
+def test_reads_after_the_log_grows_remap_it(prefix, blocks):
+    storage = fill(prefix, blocks[:5])
+    assert storage.raw(0) == blocks[0].encode()
+    first_map = storage.map
+
+    for block in blocks[5:]:
+        storage.append(block)
+    assert storage.raw(len(blocks) - 1) == blocks[-1].encode()
+    assert storage.map is not first_map
+    assert len(storage.map) == storage.size
+    assert storage.raw(2) == blocks[2].encode()
+    storage.close()
+
+
+def test_truncate(prefix, blocks):
+    storage = fill(prefix, blocks)
+    storage.raw(len(blocks) - 1)
+    storage.truncate(8)
+    assert len(storage) == 8
+    assert storage[-1].hash() == blocks[7].hash()
+
+    # Blocks appended after a truncate replace the dropped ones
+    storage.append(blocks[-1])
+    assert storage.raw(8) == blocks[-1].encode()
+    storage.close()
+
+    storage = open_storage(prefix)
+    assert len(storage) == 9
+    assert [storage.raw(index) for index in range(8)] == [block.encode() for block in blocks[:8]]
+    assert storage.raw(8) == blocks[-1].encode()
+    storage.close()
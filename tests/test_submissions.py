@@ -0,0 +1,92 @@
+"""
+Proofs sent to `/mine`: stale and repeated proofs are answered without
+hashing them again, and each repeat gets what came of the first.
+"""
+import pytest
+
+from core.api import MINE_REJECTIONS, MINE_SUBMISSIONS
+from core.chain import Blockchain
+from core.node import create_app
+
+
+def invalid_proof(block) -> int:
+    return next(proof for proof in range(1 << 20) if not Blockchain.valid_proof(str(block), proof, block.difficulty))
+
+
+def test_screening_remembers_outcomes():
+    blockchain = Blockchain(difficulty=4)
+    tip = blockchain.last_block
+
+    assert blockchain.screen_submission(1, tip.hash(), tip) is None
+    assert blockchain.screen_submission(1, tip.hash(), tip) == 'duplicate'
+    blockchain.record_submission(1, tip, 'invalid')
+    assert blockchain.screen_submission(1, None, tip) == 'invalid'
+
+    assert blockchain.screen_submission(2, None, tip) is None
+    blockchain.record_submission(2, tip, 'accepted')
+    assert blockchain.screen_submission(2, None, tip) == 'duplicate'
+
+    assert blockchain.screen_submission(3, 'not the tip', tip) == 'stale'
+
+
+def test_forgotten_proof_can_be_sent_again():
+    blockchain = Blockchain(difficulty=4)
+    tip = blockchain.last_block
+    assert blockchain.screen_submission(5, None, tip) is None
+    blockchain.record_submission(5, tip, None)
+    assert blockchain.screen_submission(5, None, tip) is None
+
+
+def test_outcomes_for_an_old_tip_are_not_recorded(mine):
+    blockchain = Blockchain(difficulty=4)
+    old = blockchain.last_block
+    assert blockchain.screen_submission(7, None, old) is None
+    new = mine(blockchain, 1)
+    assert blockchain.screen_submission(7, None, new) is None
+    blockchain.record_submission(7, old, 'invalid')
+    assert blockchain.submitted == {'7': 'pending'}
+
+
+def test_proofs_past_the_limit_are_still_checked(monkeypatch):
+    monkeypatch.setattr('core.chain.MAX_SUBMISSIONS', 2)
+    blockchain = Blockchain(difficulty=4)
+    tip = blockchain.last_block
+    for proof in range(3):
+        assert blockchain.screen_submission(proof, None, tip) is None
+    assert blockchain.screen_submission(2, None, tip) is None
+    assert len(blockchain.submitted) == 2
+
+
+@pytest.fixture
+def client():
+    blockchain = Blockchain(difficulty=4)
+    return create_app(blockchain, client_mining=True).test_client(), blockchain
+
+
+def test_repeated_invalid_proof_is_answered_invalid(client):
+    client, blockchain = client
+    tip = blockchain.last_block
+    proof = invalid_proof(tip)
+    rejected = MINE_REJECTIONS.value(reason='duplicate')
+    invalid = MINE_SUBMISSIONS.value(result='invalid')
+
+    for _ in range(2):
+        response = client.post('/mine', json={'proof': proof, 'miner': 'm', 'previous_hash': tip.hash()})
+        assert response.status_code == 400
+        assert response.json == "Invalid Proof"
+    assert MINE_SUBMISSIONS.value(result='invalid') == invalid + 2
+    assert MINE_REJECTIONS.value(reason='duplicate') == rejected
+
+
+def test_accepted_proof_is_not_accepted_twice(client):
+    client, blockchain = client
+    tip = blockchain.last_block
+    proof = Blockchain.proof_of_work(tip)
+
+    response = client.post('/mine', json={'proof': proof, 'miner': 'm', 'previous_hash': tip.hash()})
+    assert response.status_code == 200
+    response = client.post('/mine', json={'proof': proof, 'miner': 'm', 'previous_hash': tip.hash()})
+    assert response.status_code == 409
+    assert response.json['message'] == "Stale Proof"
+    assert response.json['last_block'] == dict(blockchain.last_block.header())
+    assert len(blockchain) == 2
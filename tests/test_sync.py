@@ -0,0 +1,138 @@
+"""
+Syncing with peers: finding the fork, checking the peer's blocks and
+adopting the chain with the most work. Peers are other `Blockchain`s in the
+same process, reached through a stand-in for `core.peers`.
+"""
+from math import nan
+from time import time
+
+import pytest
+
+from core import peers, wire
+from core.chain import MAX_FUTURE_SECONDS, REWARD, Block, Blockchain, InvalidBlockError, Transaction
+
+
+@pytest.fixture
+def network(monkeypatch):
+    """
+    :return: <dict> Peer URL to `Blockchain`. `core.peers` answers from it
+    """
+    chains = {}
+
+    def status(node):
+        chain = chains[node]
+        return {'length': len(chain), 'tip': chain.last_block.hash(), 'work': chain.work}
+
+    def block_hashes(node, start, limit=1):
+        chain = chains[node]
+        return [chain.block(index).hash() for index in range(start, min(len(chain), start + limit))]
+
+    def stream_blocks(node, since):
+        chain = chains[node]
+        for index in range(since + 1, len(chain)):
+            yield wire.decode_block(chain.block(index).encode_binary())
+
+    monkeypatch.setattr(peers, 'status', status)
+    monkeypatch.setattr(peers, 'block_hashes', block_hashes)
+    monkeypatch.setattr(peers, 'stream_blocks', stream_blocks)
+    return chains
+
+
+def copy_of(blockchain: Blockchain) -> Blockchain:
+    copy = Blockchain(difficulty=blockchain.difficulty)
+    with copy.lock.write():
+        copy.replace_from(0, list(blockchain.chain))
+    return copy
+
+
+def forge(blockchain: Blockchain, transactions) -> dict:
+    """
+    :return: <dict> The fields of a block with a valid proof on top of
+    `blockchain` that holds `transactions`
+    """
+    last = blockchain.last_block
+    block = Block(last.index + 1, last.timestamp + 1, Blockchain.proof_of_work(last), last.hash(), transactions, 'eve',
+                  blockchain.next_difficulty(last.timestamp + 1))
+    return dict(block)
+
+
+def test_heavier_fork_replaces_the_end_of_the_chain(network, mine):
+    local = Blockchain(difficulty=4)
+    mine(local, 3)
+    peer = copy_of(local)
+    mine(local, 1)
+    mine(peer, 3)
+    network['peer'] = peer
+
+    assert local.find_fork('peer', len(local)) == 3
+    assert local.sync_with('peer')
+    assert [block.hash() for block in local.chain] == [block.hash() for block in peer.chain]
+    assert local.work == peer.work
+    assert dict(local.balances) == dict(peer.balances)
+
+
+def test_dropped_transactions_go_back_to_the_mempool(network, mine):
+    local = Blockchain(difficulty=4)
+    mine(local, 3)
+    peer = copy_of(local)
+    local.new_transaction('miner', 'bob', 0.5)
+    mine(local, 1)
+    mine(peer, 2)
+    network['peer'] = peer
+
+    assert local.sync_with('peer')
+    assert Transaction('miner', 'bob', 0.5).hash() in local.mempool.transactions
+    assert local.balance('bob') == 0
+
+
+def test_peer_with_less_or_equal_work_is_ignored(network, mine):
+    local = Blockchain(difficulty=4)
+    mine(local, 3)
+    peer = copy_of(local)
+    mine(local, 2)
+    mine(peer, 2)
+    network['peer'] = peer
+    tip = local.last_block.hash()
+
+    assert not local.sync_with('peer')
+    assert local.last_block.hash() == tip
+
+
+def test_easier_genesis_block_is_refused(network, mine):
+    local = Blockchain(difficulty=4)
+    mine(local, 2)
+    peer = Blockchain(difficulty=1)
+    mine(peer, 40)
+    assert peer.work > local.work
+    network['peer'] = peer
+
+    with pytest.raises(InvalidBlockError, match='genesis'):
+        local.sync_with('peer')
+    assert not local.resolve_conflicts()
+
+
+@pytest.mark.parametrize('transactions, message', [
+    ([Transaction('alice', 'eve', nan)], 'invalid transaction'),
+    ([Transaction('alice', 'eve', -5)], 'invalid transaction'),
+    ([Transaction('node 2', 'eve', 1e9)], 'invalid reward'),
+    ([Transaction('node 1', 'eve', REWARD)], 'invalid reward'),
+    ([Transaction('node 2', 'eve', REWARD), Transaction('node 2', 'mallory', REWARD)], 'invalid reward'),
+])
+def test_peer_blocks_with_bad_transactions_are_refused(mine, transactions, message):
+    local = Blockchain(difficulty=4)
+    mine(local, 1)
+    fields = forge(local, transactions)
+    with pytest.raises(InvalidBlockError, match=message):
+        local.check_block(fields, local.last_block, [], 1, time())
+
+    assert local.check_block(forge(local, [Transaction('node 2', 'eve', REWARD)]), local.last_block, [], 1, time())
+
+
+@pytest.mark.parametrize('offset, message', [(-1, 'not after'), (MAX_FUTURE_SECONDS + 60, 'future')])
+def test_peer_blocks_with_bad_timestamps_are_refused(mine, offset, message):
+    local = Blockchain(difficulty=4)
+    last = mine(local, 1)
+    fields = forge(local, [])
+    fields['timestamp'] = (last.timestamp if offset < 0 else time()) + offset
+    with pytest.raises(InvalidBlockError, match=message):
+        local.check_block(fields, last, [], 1, time())
@@ -0,0 +1,126 @@
+"""
+The binary wire encoding gives back exactly the fields of the JSON form,
+and refuses bytes that are not an encoding.
+"""
+from json import dumps
+
+import pytest
+
+from core import wire
+from core.chain import Block, NO_TRANSACTIONS, PlainBlock
+
+
+def test_block_round_trip(blocks):
+    for block in blocks:
+        fields = wire.decode_block(block.encode_binary())
+        assert wire.canonical(fields) == block.encode()
+        assert Block.decode(wire.canonical(fields)).hash() == block.hash()
+
+
+def test_header_round_trip(blocks):
+    block = blocks[3]
+    fields = wire.decode_block(block.encode_binary(header_only=True))
+    assert 'transations' not in fields
+    assert wire.canonical(fields) == block.encode_header()
+
+
+def test_empty_and_pruned_blocks_round_trip(blocks):
+    empty = Block(0, 1700000000.0, 100, '1', [], 'miner', 8)
+    pruned = blocks[4].prune()
+    assert pruned.transactions is NO_TRANSACTIONS
+    for block in (empty, pruned):
+        assert wire.canonical(wire.decode_block(block.encode_binary())) == block.encode()
+
+
+def test_plain_block_round_trip():
+    block = PlainBlock(2, 1700000000.25, 12345, 'ab' * 32, [], 'miner', 8)
+    assert wire.canonical(wire.decode_block(block.encode_binary())) == block.encode()
+
+
+@pytest.mark.parametrize('value', [
+    None, True, False, 0, -1, 1, 63, -64, 2 ** 63, -2 ** 70, 0.1, -2.5, 1e300, 3.0,
+    '', 'address', 'é ☃', 'ab' * 32, 'AB' * 32, 'ab' * 31, [], [1, [2, 'x'], {'amount': 1}],
+    {'miner': 'x', 'not a key': [None, 1.5]},
+])
+def test_values_round_trip(value):
+    fields = wire.decode_block(wire.encode_block({'value': value}, listed=[value]))
+    assert fields == {'value': value, 'transations': [value]}
+    assert dumps(fields['value']) == dumps(value)
+
+
+def test_transactions_round_trip():
+    transactions = [('alice', 'bob', 1), ('bob', 'carol', 0.25), ('alice', 'alice', 1e-9), ('carol', 'bob', 2 ** 40)]
+    decoded = wire.decode_transactions(wire.encode_transactions(transactions))
+    assert decoded == [{'amount': amount, 'receiver': receiver, 'sender': sender}
+                       for sender, receiver, amount in transactions]
+    assert all(type(transaction['amount']) is type(amount)
+               for transaction, (_, _, amount) in zip(decoded, transactions))
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64, 1 << 16])
+def test_records_split_across_chunks(blocks, size):
+    encoded = [block.encode_binary() for block in blocks]
+    stream = b''.join(wire.record(block) for block in encoded)
+    chunks = [stream[start:start + size] for start in range(0, len(stream), size)]
+    assert list(wire.read_records(chunks)) == encoded
+
+
+def test_records_cut_short(blocks):
+    stream = b''.join(wire.record(block.encode_binary()) for block in blocks[:3])
+    with pytest.raises(wire.WireError):
+        list(wire.read_records([stream[:-1]]))
+
+
+def test_every_truncated_block_is_refused(blocks):
+    encoded = blocks[2].encode_binary()
+    for end in range(len(encoded)):
+        with pytest.raises(wire.WireError):
+            wire.decode_block(encoded[:end])
+
+
+def test_trailing_bytes_and_unknown_versions_are_refused(blocks):
+    encoded = blocks[2].encode_binary()
+    with pytest.raises(wire.WireError):
+        wire.decode_block(encoded + b'\x00')
+    with pytest.raises(wire.WireError):
+        wire.decode_block(bytes([wire.VERSION + 1]) + encoded[1:])
+
+    batch = wire.encode_transactions([('alice', 'bob', 1)])
+    with pytest.raises(wire.WireError):
+        wire.decode_transactions(batch + b'\x00')
+    for end in range(len(batch)):
+        with pytest.raises(wire.WireError):
+            wire.decode_transactions(batch[:end])
+
+
+@pytest.mark.parametrize('data', [
+    # A list as a dict key
+    bytes([wire.VERSION, wire.DICT, 1, wire.LIST, 0, wire.NONE, wire.HEADER_ONLY]),
+    # Lists nested deeper than the decoder recurses
+    bytes([wire.VERSION]) + bytes([wire.LIST, 1]) * 100000,
+    # An unknown tag and an unknown transactions section
+    bytes([wire.VERSION, 0xee]),
+    bytes([wire.VERSION, wire.DICT, 0, 0xee]),
+])
+def test_malformed_blocks_are_refused(data):
+    with pytest.raises(wire.WireError):
+        wire.decode_block(data)
+
+
+def test_corrupted_bytes_never_escape_as_other_errors(blocks):
+    encoded = blocks[2].encode_binary()
+    for position in range(len(encoded)):
+        corrupted = bytearray(encoded)
+        corrupted[position] ^= 0xff
+        try:
+            wire.decode_block(bytes(corrupted))
+        except wire.WireError:
+            pass
+
+
+def test_prefers_binary():
+    assert wire.prefers_binary(wire.MIMETYPE)
+    assert wire.prefers_binary(f'application/json;q=0.5, {wire.MIMETYPE}')
+    assert not wire.prefers_binary('')
+    assert not wire.prefers_binary('*/*')
+    assert not wire.prefers_binary(f'application/json, {wire.MIMETYPE};q=0.9')